@@ -4,7 +4,7 @@ load("@bazel_tools//tools/build_defs/repo:git.bzl", "git_repository")
 load("@bazel_tools//tools/build_defs/repo:http.bzl", "http_archive")
 load("@bazel_tools//tools/build_defs/repo:local.bzl", "new_local_repository")
 load("@ofiuco//lib:defs.bzl", "lib")
-load("@ofiuco//python/private:lock_parser.bzl", "parse_lock")
+load("@ofiuco//python/private:lock_parser.bzl", "lock_parser_command", "parse_lock")
 load("@ofiuco_defs//:defs.bzl", _python_host = "python_host")
 
 def _parse_impl(mctx):
@@ -18,7 +18,18 @@ def _parse_impl(mctx):
             if attr.toml:
                 mctx.watch(attr.toml)
 
-            # Create repository with packages
+            # Parse lock file once for packages and external repositories of Python packages
+            result = mctx.execute(lock_parser_command(mctx, attr, output = "all") + [
+                "--index_max_in_flight={}".format(attr.index_max_in_flight),
+                "--index_timeout={}".format(attr.index_timeout),
+            ])
+
+            if result.return_code != 0:
+                fail(result.stderr)
+
+            parsed = json.decode(result.stdout)
+
+            # Create repository with packages which are read by the repository rule from the parser cache
             parse_lock(
                 name = attr.name,
                 lock = attr.lock,
@@ -26,23 +37,16 @@ def _parse_impl(mctx):
                 deps = attr.deps,
                 generate_extras = attr.generate_extras,
                 enable_rust = attr.enable_rust,
+                collapse_cycles = attr.collapse_cycles,
+                prune_files = attr.prune_files,
+                prune_unreachable = attr.prune_unreachable,
+                share_selects = attr.share_selects,
                 platforms = attr.platforms,
+                shards = attr.shards,
             )
 
-            # Parse external repositories for Python packages
-            interpreter = mctx.path(attr._python_host)
-            result = mctx.execute([
-                interpreter,
-                mctx.path(attr._lock_parser),
-                mctx.path(attr.lock),
-                "--output=files",
-            ] + (["--project_file={}".format(mctx.path(attr.toml))] if attr.toml else []))
-
-            if result.return_code != 0:
-                fail(result.stderr)
-
             # Collect repository definitions
-            for file in json.decode(result.stdout):
+            for file in parsed["files"]:
                 repo_name = file["name"]
 
                 # Track unique repositories by name
@@ -92,6 +96,13 @@ parse = module_extension(
                 "deps": attr.string_list_dict(),
                 "generate_extras": attr.bool(default = True),
                 "enable_rust": attr.bool(default = False),
+                "collapse_cycles": attr.bool(default = False),
+                "prune_files": attr.bool(default = False),
+                "prune_unreachable": attr.bool(default = False),
+                "share_selects": attr.bool(default = False),
+                "index_max_in_flight": attr.int(default = 16),
+                "index_timeout": attr.int(default = 60),
+                "shards": attr.int(default = 0),
                 "platforms": attr.string_dict(),
                 "build_files": attr.string_dict(),
                 "_lock_parser": attr.label(
@@ -2,6 +2,56 @@
 
 load("@ofiuco_defs//:defs.bzl", _python_host = "python_host")
 
+# Environment variable with a directory of the lock parser output cache
+_CACHE_DIR_ENV = "OFIUCO_CACHE_DIR"
+
+# Default cache directory in the output base shared by the module extension and repository rules
+_CACHE_DIR_DEFAULT = "ofiuco_cache"
+
+# Environment variables with a directory of the lock parser profiles and a number of profiled functions
+_PROFILE_DIR_ENV = "OFIUCO_PROFILE_DIR"
+_PROFILE_FUNCTIONS_ENV = "OFIUCO_PROFILE_FUNCTIONS"
+
+def _cache_dir(ctx):
+    """Lock parser cache directory from the environment or in the output base.
+
+    The module extension working directory and repository directories are two levels below the output base.
+    """
+    return ctx.getenv(_CACHE_DIR_ENV) or str(ctx.path(".").dirname.dirname.get_child(_CACHE_DIR_DEFAULT))
+
+def lock_parser_command(ctx, attrs, output = None):
+    """Command line to run the lock parser with the lock attributes.
+
+    Args:
+        ctx: repository or module context
+        attrs: parse_lock repository rule attributes or lock tag class attributes
+        output: optional output kind, one of "packages", "files" or "all"
+
+    Returns:
+        The list of command line arguments.
+    """
+    cache_dir = _cache_dir(ctx)
+    profile_dir = ctx.getenv(_PROFILE_DIR_ENV)
+    profile_functions = ctx.getenv(_PROFILE_FUNCTIONS_ENV) if profile_dir else None
+    return [
+        ctx.path(attrs._python_host),
+        ctx.path(attrs._lock_parser),
+        ctx.path(attrs.lock),
+        json.encode(attrs.platforms),
+        "--{}generate_extras".format("" if attrs.generate_extras else "no-"),
+        "--{}enable_rust".format("" if attrs.enable_rust else "no-"),
+        "--{}collapse_cycles".format("" if attrs.collapse_cycles else "no-"),
+        "--{}prune_files".format("" if attrs.prune_files else "no-"),
+        "--{}prune_unreachable".format("" if attrs.prune_unreachable else "no-"),
+        "--{}share_selects".format("" if attrs.share_selects else "no-"),
+    ] + (["--deps={}".format(json.encode(attrs.deps))] if attrs.deps else []) + \
+           (["--project_file={}".format(ctx.path(attrs.toml))] if attrs.toml else []) + \
+           (["--output={}".format(output)] if output else []) + \
+           (["--shards={}".format(attrs.shards)] if attrs.shards else []) + \
+           ["--cache_dir={}".format(cache_dir)] + \
+           (["--profile={}/{}.json".format(profile_dir, attrs.name)] if profile_dir else []) + \
+           (["--profile_functions={}".format(profile_functions)] if profile_functions else [])
+
 def _parse_lock_impl(rctx):
     self = str(rctx.path(rctx.attr._self)).split("/external/")[-1]
     header = "# Autogenerated file by _parse_lock_impl in {}".format(self)
@@ -11,26 +61,29 @@ def _parse_lock_impl(rctx):
     rules_repository = rules_repository.split("+")[0]
     prefix = '''load("{name}//python/private:package_deps.bzl", "package", "rust_package")'''.format(name = rules_repository)
 
-    interpreter = rctx.path(rctx.attr._python_host)
+    # Packages are read from the output=all cache entry of the module extension, and only if it is missing
+    # or evicted then they are generated again without index pages
     rctx.watch(rctx.attr.lock)
     rctx.watch(rctx.attr._lock_parser)
     if rctx.attr.toml:
         rctx.watch(rctx.attr.toml)
 
-    exec_result = rctx.execute([
-                                   interpreter,
-                                   rctx.path(rctx.attr._lock_parser),
-                                   rctx.path(rctx.attr.lock),
-                                   json.encode(rctx.attr.platforms),
-                                   "--{}generate_extras".format("" if rctx.attr.generate_extras else "no-"),
-                                   "--{}enable_rust".format("" if rctx.attr.enable_rust else "no-"),
-                               ] + (["--deps={}".format(json.encode(rctx.attr.deps))] if rctx.attr.deps else []) +
-                               (["--project_file={}".format(rctx.path(rctx.attr.toml))] if rctx.attr.toml else []))
+    exec_result = rctx.execute(lock_parser_command(rctx, rctx.attr))
 
     if exec_result.return_code:
         fail("Parsing {} failed with exit code {}\n{}\n".format(rctx.attr.lock, exec_result.return_code, exec_result.stderr))
 
-    rctx.file("BUILD.bazel", "{}\n\n{}\n\n{}".format(header, prefix, exec_result.stdout))
+    build_file_content = exec_result.stdout
+    shards = {}
+    if rctx.attr.shards:
+        parsed = json.decode(build_file_content)
+        build_file_content = parsed["packages"]
+        shards = parsed["shards"]
+
+    # Root package with package targets or with aliases of targets in shard packages
+    rctx.file("BUILD.bazel", "{}\n\n{}\n\n{}".format(header, prefix, build_file_content))
+    for shard, shard_content in shards.items():
+        rctx.file("{}/BUILD.bazel".format(shard), "{}\n\n{}\n\n{}".format(header, prefix, shard_content))
 
 parse_lock = repository_rule(
     attrs = {
@@ -53,9 +106,29 @@ parse_lock = repository_rule(
             default = False,
             doc = "Enable rust toolchain when compiling Python packages",
         ),
+        "collapse_cycles": attr.bool(
+            default = False,
+            doc = "Generate a single target for each dependency cycle instead of removing cycle edges",
+        ),
+        "prune_files": attr.bool(
+            default = False,
+            doc = "Keep only wheels and sdists which can be used at platforms with platform_tags",
+        ),
+        "prune_unreachable": attr.bool(
+            default = False,
+            doc = "Generate stub targets without files for packages which are not used at any of platforms",
+        ),
+        "share_selects": attr.bool(
+            default = False,
+            doc = "Render select conditions mapped to the same wheel as condition lists shared by packages",
+        ),
         "platforms": attr.string_dict(
             doc = "The mapping of interpter substrings to Python platform tags and environment markers as a JSON string",
         ),
+        "shards": attr.int(
+            default = 0,
+            doc = "Number of packages with package targets, if set then the root package contains only aliases",
+        ),
         "_lock_parser": attr.label(
             allow_single_file = True,
             default = ":lock_parser.py",
@@ -1,28 +1,36 @@
 import argparse
-import asyncio
-import bisect
-import gzip
-import html.parser
+import contextlib
+import copy
+import functools
+import hashlib
 import itertools
 import json
 import os
 import re
 import sys
+import time
 import tomllib
-import urllib
 import urllib.parse
-import urllib.request
 from collections import defaultdict
 from dataclasses import dataclass, field
 from enum import StrEnum, auto
 from operator import attrgetter, itemgetter
 from pathlib import Path
-from typing import Any
+from typing import Any, NamedTuple
 
 NEW_ISSUE_URL = "https://github.com/oxidase/ofiuco/issues/new"
 TODO_MESSAGE = f"TODO: raise new issue at {NEW_ISSUE_URL} for adding support of {{}}"
 PYPI_SIMPLE_MIME_TYPE = "application/vnd.pypi.simple.v1+json"
 
+# Simple repository API project pages
+# References:
+# [PEP 503 – Simple Repository API](https://peps.python.org/pep-0503/)
+# [PEP 691 – JSON-based Simple API for Python Package Indexes](https://peps.python.org/pep-0691/)
+SIMPLE_JSON_FILES_RE = re.compile(r'"files"\s*:\s*\[')
+SIMPLE_JSON_SEPARATOR_RE = re.compile(r"[\s,]*")
+SIMPLE_HTML_ANCHOR_RE = re.compile(rb"""<a\s[^>]*?\bhref\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'>]+))""", re.IGNORECASE)
+SHA256_FRAGMENT_RE = re.compile(rb"#sha256=([0-9a-fA-F]{64})")
+
 # Python Versioning
 # References:
 # [Versioning](https://packaging.python.org/en/latest/discussions/versioning/)
@@ -50,6 +58,16 @@ WHEEL_RE = re.compile(
 )
 
 WHEEL_PLATFORM_MACOSX_RE = re.compile(r"^macosx_(?P<major>\d+)_(?P<minor>\d+)_(?P<arch>.+)$")
+# Architectures contained in macOS multi-architecture wheel platforms as in packaging.tags.mac_platforms
+MACOSX_FAT_ARCHES = {
+    "universal2": ("arm64", "x86_64"),
+    "universal": ("i386", "ppc", "ppc64", "x86_64"),
+    "intel": ("i386", "x86_64"),
+    "fat": ("i386", "ppc"),
+    "fat3": ("i386", "ppc", "x86_64"),
+    "fat32": ("i386", "ppc"),
+    "fat64": ("ppc64", "x86_64"),
+}
 WHEEL_PLATFORM_MUSLLINUX_RE = re.compile(r"^musllinux_(?P<major>\d+)_(?P<minor>\d+)_(?P<arch>.+)$")
 WHEEL_PLATFORM_MANYLINUX_RE = re.compile(
     r"^manylinux(?:(?P<legacy>\d+))?(?:_(?P<major>\d+)_(?P<minor>\d+))?_(?P<arch>[^.]+)$"
@@ -60,6 +78,39 @@ WHEEL_PLATFORM_RE = re.compile(
     r"(?P<arch>(aarch(32|64)|arm(64(_32|e)?|v[0-9]l?)?|cortex-r(52|82)|i[36]86|mips64|ppc(32|64([bl]e)?)?|riscv(32|64)|s390x|x86_(32|64)))$"
 )
 
+# Dependency specification markers
+# References:
+# [PEP 508 – Dependency specification](https://peps.python.org/pep-0508/#environment-markers)
+MARKER_TOKEN_RE = re.compile(
+    r"""\s*(?:(?P<string>'[^']*'|"[^"]*")"""
+    r"|(?P<operator>===|==|!=|<=|>=|~=|<|>|not\s+in\b|in\b)"
+    r"|(?P<keyword>and\b|or\b)"
+    r"|(?P<parenthesis>[()])"
+    r"|(?P<variable>[A-Za-z_][A-Za-z0-9_.]*))"
+)
+MARKER_VERSION_VARIABLES = {"python_version", "python_full_version", "implementation_version"}
+
+# Minor Python versions of toolchains for which markers are resolved at generation time
+MARKER_PYTHON_VERSIONS = ("3.11", "3.12", "3.13", "3.14")
+
+# Starts of package stanzas in generated BUILD files, extras targets are a part of the package stanza
+STANZA_RE = re.compile(r'\n(?:package|rust_package|alias)\(\n  name = "([^"]+)"')
+
+# Name suffixes of aggregate targets for dependency cycles and of the aggregated packages
+CYCLE_SUFFIX = "@cycle"
+CYCLE_MEMBER_SUFFIX = "@package"
+
+# x86-64 micro-architecture levels of wheel variants in local version labels or build tags
+CPU_LEVEL_RE = re.compile(r"x86_?64_?v(?P<level>[2-4])|(?P<avx512>avx512)|(?P<avx2>avx2)|(?P<sse4>sse4)", re.IGNORECASE)
+
+# Libc versions of wheels selected for Linux conditions
+GLIBC_VERSION = (2, 31)
+MUSL_VERSION = (1, 1)
+
+# CPython minor versions with stable ABI conditions in python/platforms, the generic cp3x-abi3 condition
+# selects wheels for the oldest supported version
+STABLE_ABI_MINOR_VERSIONS = range(11, 17)
+
 MACOSX_VERSIONS = [
     (10, 9),  # Mavericks
     (10, 10),  # Yosemite
@@ -76,8 +127,17 @@ MACOSX_VERSIONS = [
     (16, 0),  # Tahoe
 ]
 
-with gzip.open(Path(__file__).parent / "rust_packages.gz", "rt") as rust_packages_file:
-    RUST_PACKAGES = [line.strip() for line in rust_packages_file.readlines() if line.strip()]
+
+@functools.cache
+def get_rust_packages():
+    """Names of packages with Rust sources loaded on the first lookup.
+
+    Ref: https://pypi.org/search/?c=Programming+Language+%3A%3A+Rust
+    """
+    import gzip
+
+    with gzip.open(Path(__file__).parent / "rust_packages.gz", "rt") as rust_packages_file:
+        return frozenset(name for line in rust_packages_file if (name := line.strip()))
 
 
 def normalize_basename(name):
@@ -108,77 +168,178 @@ def get_select_condition(parts):
     return "{python_tag}-{abi_tag}-{platform}".format(**parts)
 
 
-def get_best_match(wheel_targets, *, glibc, musl):
-    # Return an item (condition, parts, target) from the list if there is no ambiguity
-    if len(wheel_targets) == 1:
-        return wheel_targets.pop()
+class WheelTag(NamedTuple):
+    """Compatibility tags of wheel file names with the select condition shared by all wheels with the same tags."""
 
-    # Getter for (version, wheel_target) tuples
-    version_getter = itemgetter(0)
+    python_tag: str
+    abi_tag: str
+    platform: str
+    condition: str
 
-    # Check for musllinux libc
-    musllinux = [
-        (WHEEL_PLATFORM_MUSLLINUX_RE.match(platform), (condition, parts, target))
-        for condition, parts, target in wheel_targets
-        for platform in parts["platform"].split(".")
-    ]
-    if all(m for m, _ in musllinux) and len(set(m["arch"] for m, _ in musllinux)) == 1:
 
-        def _version(m):
-            return (int(m["major"]), int(m["minor"]))
+@functools.cache
+def get_wheel_tag(python_tag, abi_tag, platform):
+    parts = normalize_target_parts(dict(python_tag=python_tag, abi_tag=abi_tag, platform=platform))
+    return WheelTag(python_tag, abi_tag, platform, get_select_condition(parts))
 
-        ordered = sorted(((_version(m), target) for m, target in musllinux), key=version_getter, reverse=True)
-        _, selected = next(((version, target) for version, target in ordered if version <= musl), ordered.pop())
-        return selected
 
-    # Check for manylinux libc
-    manylinux = [
-        (WHEEL_PLATFORM_MANYLINUX_RE.match(platform), (condition, parts, target))
-        for condition, parts, target in wheel_targets
-        for platform in parts["platform"].split(".")
-    ]
-    if all(m for m, _ in manylinux) and len(set(m["arch"] for m, _ in manylinux)) == 1:
+def parse_wheel_tag(wheel):
+    """Wheel tag of a wheel file name without the extension or None if the name does not match."""
+    if m := WHEEL_RE.match(wheel):
+        return get_wheel_tag(m["python_tag"], m["abi_tag"], m["platform"])
+    return None
 
-        def _version(m):
-            if m["legacy"]:
-                return {"2010": (2, 12), "2014": (2, 17)}.get(m["legacy"], (2, 5))
-            return (int(m["major"]), int(m["minor"]))
-
-        ordered = sorted(((_version(m), target) for m, target in manylinux), key=version_getter, reverse=True)
-        _, selected = next(((version, target) for version, target in ordered if version <= glibc), ordered.pop())
-        return selected
-
-    # Check for multiple CPython versions with stable 'abi3' tags
-    abi3_tags = [
-        (int(parts["python_tag"].removeprefix("cp3")), (condition, parts, target))
-        for condition, parts, target in wheel_targets
-        if parts["python_tag"].startswith("cp3") and parts["abi_tag"] == "abi3"
-    ]
-    if len(abi3_tags) == len(wheel_targets):
-        ordered = sorted(abi3_tags, key=version_getter, reverse=True)
-        _, selected = ordered.pop()
-        return selected
 
-    raise RuntimeError(TODO_MESSAGE.format(f"best match selection for {wheel_targets = }"))
+class WheelPlatform(NamedTuple):
+    libc: str | None
+    version: tuple[int, int] | None
+    arch: str | None
 
 
-def get_back_compatible_targets(parts, wheel_target):
-    parts = normalize_target_parts(parts)
+@functools.cache
+def parse_wheel_platforms(platform):
+    """Libc kinds, versions and architectures of platform tags separated by dots."""
 
+    def _parse(platform):
+        if m := WHEEL_PLATFORM_MUSLLINUX_RE.match(platform):
+            return WheelPlatform("musl", (int(m["major"]), int(m["minor"])), m["arch"])
+        if m := WHEEL_PLATFORM_MANYLINUX_RE.match(platform):
+            if m["legacy"]:
+                return WheelPlatform("glibc", {"2010": (2, 12), "2014": (2, 17)}.get(m["legacy"], (2, 5)), m["arch"])
+            return WheelPlatform("glibc", (int(m["major"]), int(m["minor"])), m["arch"])
+        return WheelPlatform(None, None, None)
+
+    return tuple(_parse(platform) for platform in platform.split("."))
+
+
+@functools.cache
+def get_platform_priority(platform, glibc, musl):
+    """Priority of dot-separated wheel platform tags for libc versions in the pip get_sorted_tags order.
+
+    Compatible tags precede incompatible ones, newer libc versions are preferred for compatible tags and
+    older versions for incompatible tags. Tags without libc versions are compatible and follow libc tags.
+    """
+    priorities = []
+    for wheel in parse_wheel_platforms(platform):
+        libc_version = {"glibc": glibc, "musl": musl}.get(wheel.libc)
+        if wheel.version is None or libc_version is None:
+            priorities.append((True, wheel.version or (0, 0)))
+        elif wheel.version <= libc_version:
+            priorities.append((True, wheel.version))
+        else:
+            priorities.append((False, tuple(-part for part in wheel.version)))
+    return max(priorities)
+
+
+def is_freethreaded_abi(python_tag, abi_tag):
+    """Check if the ABI tag is a free-threaded CPython ABI like cp313t."""
+    return python_tag.startswith("cp3") and abi_tag == f"{python_tag}t"
+
+
+@functools.cache
+def get_abi_priority(python_tag, abi_tag, python_minor):
+    """Priority of Python and ABI tags for a CPython minor version or None if the wheel can not be used.
+
+    Version-specific ABI tags precede stable 'abi3' tags which precede 'none' tags. The newest 'abi3' build
+    is preferred for a known minor version and the oldest one for conditions without Python version.
+    """
+    if abi_tag == "abi3" and python_tag.startswith("cp3") and python_tag[3:].isdigit():
+        version = int(python_tag[3:])
+        if python_minor is None:
+            return (1, -version)
+        return (1, version) if version <= python_minor else None
+    return (0 if abi_tag == "none" else 2, 0)
+
+
+def get_best_match(wheel_targets, *, glibc, musl, python_minor=None):
+    """Item (condition, parts, target) with the highest tag priority or None if no wheel can be used.
+
+    Items are ranked by compatibility of platform tags, Python and ABI tags and then by platform tags,
+    so mixed sets of libc versions, ABI tags and Python versions are resolved. Ties go to the last item.
+    """
+    best, best_priority = None, None
+    for wheel_target in wheel_targets:
+        _, parts, _ = wheel_target
+        if (abi_priority := get_abi_priority(parts["python_tag"], parts["abi_tag"], python_minor)) is None:
+            continue
+        compatible, platform_priority = get_platform_priority(parts["platform"], glibc, musl)
+        priority = (compatible, abi_priority, platform_priority)
+        if best_priority is None or priority >= best_priority:
+            best, best_priority = wheel_target, priority
+    return best
+
+
+def get_platform_best_match(wheel_targets, libc_versions=None, python_minor=None):
+    """Best match for libc versions per (libc, arch) of the wheels architecture or GLIBC_VERSION and MUSL_VERSION."""
+    platforms = (wheel for _, parts, _ in wheel_targets for wheel in parse_wheel_platforms(parts["platform"]))
+    arch = next((wheel.arch for wheel in platforms if wheel.arch), None)
+    glibc = (libc_versions or {}).get(("glibc", arch), GLIBC_VERSION)
+    musl = (libc_versions or {}).get(("musl", arch), MUSL_VERSION)
+    return get_best_match(wheel_targets, glibc=glibc, musl=musl, python_minor=python_minor)
+
+
+@functools.cache
+def get_wheel_cpu_level(wheel):
+    """x86-64 micro-architecture level of a wheel variant or None for baseline wheels.
+
+    Levels are derived from local version labels and build tags like 1.26.4+avx2 or 2.0+x86_64_v3
+    of x86-64 wheels, local version separators are replaced by dashes in normalized file names.
+    """
+    if not (m := WHEEL_RE.match(wheel)) or not m["build_tag"] or not (platform := m["platform"]):
+        return None
+    if "x86_64" not in platform and "amd64" not in platform:
+        return None
+    if not (level := CPU_LEVEL_RE.search(m["build_tag"])):
+        return None
+    return int(level["level"]) if level["level"] else 4 if level["avx512"] else 3 if level["avx2"] else 2
+
+
+def get_cpu_levels(platforms):
+    """Highest x86-64 micro-architecture levels of cpu_level keys like x86_64_v3 of platforms."""
+    levels = {}
+    for value in (platforms or {}).values():
+        try:
+            cpu_level = json.loads(value).get("cpu_level", "")
+        except (json.JSONDecodeError, AttributeError):
+            continue
+        if m := re.fullmatch(r"x86_64_v(\d)", str(cpu_level)):
+            levels["x86_64"] = max(levels.get("x86_64", 0), int(m[1]))
+    return levels
+
+
+@functools.cache
+def get_back_compatible_conditions(python_tag, abi_tag, platform):
     # Add back-compatible select conditions for MacOS platforms separated by dots
     macosx_platforms = [
         (int(m["major"]), int(m["minor"]), m["arch"])
-        for p in parts["platform"].split(".")
+        for p in platform.split(".")
         if (m := WHEEL_PLATFORM_MACOSX_RE.match(p))
     ]
-    if macosx_platforms:
-        wheels = {}
-        for minimum_major, minimum_minor, arch in macosx_platforms:
-            for major, minor in MACOSX_VERSIONS:
-                if major > minimum_major or major == minimum_major and minor >= minimum_minor:
-                    back_compatible = f"{parts['python_tag']}-{parts['abi_tag']}-macosx_{major}_{minor}_{arch}"
-                    wheels[back_compatible] = wheel_target
-        return wheels
+    return tuple(
+        f"{python_tag}-{abi_tag}-macosx_{major}_{minor}_{arch}"
+        for minimum_major, minimum_minor, arch in macosx_platforms
+        for major, minor in MACOSX_VERSIONS
+        if major > minimum_major or major == minimum_major and minor >= minimum_minor
+    )
+
+
+def get_back_compatible_targets(parts, wheel_target):
+    parts = normalize_target_parts(dict(parts))
+    if conditions := get_back_compatible_conditions(parts["python_tag"], parts["abi_tag"], parts["platform"]):
+        return dict.fromkeys(conditions, wheel_target)
+    return None
+
+
+def local_label(name):
+    return f":{name}"
+
+
+@functools.cache
+def get_shard(name, shards):
+    """Package path of the shard with the target, versioned, cycle and extras targets share the shard of the package."""
+    base_name = name.split("@", 1)[0].split("[", 1)[0]
+    index = int.from_bytes(hashlib.sha256(base_name.encode()).digest()[:8], "big") % shards
+    return f"_shard_{index:0{len(str(shards - 1))}d}"
 
 
 class SourceType(StrEnum):
@@ -193,7 +354,7 @@ class SourceType(StrEnum):
     virtual = auto()
 
 
-@dataclass
+@dataclass(slots=True)
 class Source:
     type: SourceType
     url: str | None = None
@@ -244,13 +405,14 @@ class Source:
         raise NotImplementedError(f"for {project_root = } and {kwargs = }")
 
 
-@dataclass
+@dataclass(slots=True)
 class Package:
     name: str
     version: str | None = None
     description: str = ""
     files: dict[str, str] = field(default_factory=dict)
     urls: dict[str, str] = field(default_factory=dict)
+    sizes: dict[str, int] = field(default_factory=dict)
     markers: str = ""
     dependencies: dict[str, Any] = field(default_factory=dict)
     extra_dependencies: list[str] = field(default_factory=list)
@@ -258,56 +420,173 @@ class Package:
     source: Source | None = None
     develop: bool = False
 
+    # Derived views computed on the first access and reset when files or version are assigned
+    _semver: tuple[int, int, int, int] | None = field(default=None, init=False, repr=False, compare=False)
+    _wheels: dict[str, str] | None = field(default=None, init=False, repr=False, compare=False)
+    _sdist: dict[str, str] | None = field(default=None, init=False, repr=False, compare=False)
+
+    def __setattr__(self, name, value):
+        if name == "files":
+            object.__setattr__(self, "_wheels", None)
+            object.__setattr__(self, "_sdist", None)
+        elif name == "version":
+            object.__setattr__(self, "_semver", None)
+        object.__setattr__(self, name, value)
+
     @property
     def semver(self) -> tuple[int, int, int, int]:
-        if self.version is not None and (m := re.match(SEMVER_RE, self.version)) is not None:
-            return (int(m["major"]), int(m["minor"] or 0), int(m["patch"] or 0), int(m["rev"] or 0))
-        return (0, 0, 0, 0)
+        if self._semver is None:
+            if self.version is not None and (m := SEMVER_RE.match(self.version)) is not None:
+                self._semver = (int(m["major"]), int(m["minor"] or 0), int(m["patch"] or 0), int(m["rev"] or 0))
+            else:
+                self._semver = (0, 0, 0, 0)
+        return self._semver
 
     @property
     def wheels(self) -> dict[str, str]:
-        return {k.removesuffix(".whl"): v for k, v in self.files.items() if k.endswith(".whl")}
+        if self._wheels is None:
+            self._wheels = {k.removesuffix(".whl"): v for k, v in self.files.items() if k.endswith(".whl")}
+        return self._wheels
 
     @property
     def sdist(self) -> dict[str, str]:
-        return {k.removesuffix(".tar.gz"): v for k, v in self.files.items() if k.endswith(".tar.gz")}
+        if self._sdist is None:
+            self._sdist = {k.removesuffix(".tar.gz"): v for k, v in self.files.items() if k.endswith(".tar.gz")}
+        return self._sdist
 
     @property
     def select(self):
-        if self.source and self.source.type == SourceType.virtual:
-            # Virtual packages should hold only dependencies
-            return []
+        return self.render_select(self.select_conditions)
 
-        if self.source and self.source.type not in {SourceType.legacy, SourceType.url}:
-            # Pre-built wheel file or directory package
-            kind = "whl" if self.source.is_whl else "pkg"
-            return [f'"@{self.name}//:{kind}"']
+    @staticmethod
+    def render_select(conditions):
+        if len(conditions) <= 1:
+            return [target for _, target in conditions]
 
-        # Collect wheel tags and corresponding targets
-        wheels = {}
+        return ["select({", *[f"  {condition}: {target}," for condition, target in conditions], "})"]
+
+    @property
+    def select_conditions(self):
+        return self.get_select_conditions()
+
+    def group_wheels(self):
+        """Wheel items (condition, parts, target) with supported Python tags grouped by select conditions."""
         condition_getter = itemgetter(0)
         for condition, wheels_group in itertools.groupby(
             sorted(
                 (
-                    (get_select_condition(normalize_target_parts(m.groupdict())), m.groupdict(), f'"@{wheel}//:whl"')
+                    (tag.condition, tag._asdict(), f'"@{wheel}//:whl"')
                     for wheel in self.wheels
-                    if (m := re.match(WHEEL_RE, wheel))
-                    and (m["python_tag"].startswith("cp3") or ("py3" in m["python_tag"].split(".")))
+                    if (tag := parse_wheel_tag(wheel))
+                    and (tag.python_tag.startswith("cp3") or ("py3" in tag.python_tag.split(".")))
                 ),
                 key=condition_getter,
             ),
             key=condition_getter,
         ):
-            wheels_list = list(wheels_group)
-            _, parts, wheel_best_target = get_best_match(wheels_list, glibc=(2, 31), musl=(1, 1))
+            yield condition, list(wheels_group)
+
+    def get_variant_conditions(self, libc_versions=None, cpu_levels=None):
+        """Mappings of CPU level variant targets to level names per Starlark condition.
+
+        The best variant is selected per condition and CPU level up to the highest level of cpu_levels.
+        """
+        if not cpu_levels or not self.version:
+            return {}
+        if self.source and self.source.type not in {SourceType.legacy, SourceType.url}:
+            return {}
+
+        levels = {
+            f'"@{wheel}//:whl"': level
+            for wheel in self.wheels
+            if (level := get_wheel_cpu_level(wheel)) and level <= cpu_levels.get("x86_64", 0)
+        }
+        if not levels:
+            return {}
+
+        variants = defaultdict(dict)
+        for condition, wheels_list in self.group_wheels():
+            for level in sorted({levels[target] for _, _, target in wheels_list if target in levels}):
+                variant = [item for item in wheels_list if levels.get(item[2]) == level]
+                _, parts, wheel_target = get_platform_best_match(variant, libc_versions)
+                for key in get_back_compatible_targets(parts, wheel_target) or [condition]:
+                    variants[f'"@ofiuco//python/platforms:{key}"'][wheel_target] = f"x86_64_v{level}"
+        return variants
+
+    @staticmethod
+    def render_variants(variants):
+        if not variants:
+            return []
+
+        def render(targets):
+            return "{" + ", ".join(f'{target}: "{level}"' for target, level in targets.items()) + "}"
+
+        return [
+            "select({",
+            *(f"  {condition}: {render(targets)}," for condition, targets in variants.items()),
+            '  "//conditions:default": {},',
+            "})",
+        ]
+
+    def get_select_conditions(self, libc_versions=None):
+        """Pairs of Starlark conditions and targets, a single pair with None condition for unconditional targets.
+
+        Linux wheels are selected for libc versions per (libc, arch) of get_libc_versions
+        with GLIBC_VERSION and MUSL_VERSION for other architectures.
+        """
+        if self.source and self.source.type == SourceType.virtual:
+            # Virtual packages should hold only dependencies
+            return []
+
+        if self.source and self.source.type not in {SourceType.legacy, SourceType.url}:
+            # Pre-built wheel file or directory package
+            kind = "whl" if self.source.is_whl else "pkg"
+            return [(None, f'"@{self.name}//:{kind}"')]
+
+        def best_match(wheels_list, python_minor=None):
+            return get_platform_best_match(wheels_list, libc_versions, python_minor)
+
+        # Collect wheel tags and corresponding targets, CPU level variants are not selected as baseline wheels
+        # as hosts without the CPU level can not load them, so such conditions fall back to the source distribution
+        wheels, abi3_groups = {}, []
+        levels = {f'"@{wheel}//:whl"': level for wheel in self.wheels if (level := get_wheel_cpu_level(wheel))}
+        for condition, wheels_list in self.group_wheels():
+            if not (wheels_list := [item for item in wheels_list if item[2] not in levels]):
+                continue
+            match = best_match(wheels_list, STABLE_ABI_MINOR_VERSIONS[0]) or best_match(wheels_list)
+            _, parts, wheel_best_target = match
             wheels.update(get_back_compatible_targets(parts, wheel_best_target) or {condition: wheel_best_target})
+            if parts["abi_tag"] == "abi3":
+                abi3_groups.append((wheels_list, wheel_best_target))
 
         if any_platform := next((target for condition, target in wheels.items() if condition.endswith("any")), None):
-            return [any_platform]
+            return [(None, any_platform)]
+
+        # Newer stable ABI builds for CPython minor versions which differ from the generic condition target,
+        # conditions are skipped if they would be ambiguous with conditions of version-specific wheels for the same
+        # Python version and platform, free-threaded conditions are disjoint with stable ABI conditions
+        specific = set()
+        for condition in wheels:
+            python_tag, abi_tag, platform = condition.split("-", 2)
+            if not is_freethreaded_abi(python_tag, abi_tag):
+                specific.add((python_tag, platform))
+        for wheels_list, wheel_generic_target in abi3_groups:
+            for minor in STABLE_ABI_MINOR_VERSIONS:
+                if (match := best_match(wheels_list, minor)) is None or match[2] == wheel_generic_target:
+                    continue
+                _, parts, wheel_target = match
+                python_tag = f"cp3{minor}"
+                conditions = get_back_compatible_conditions(python_tag, "abi3", parts["platform"]) or (
+                    get_select_condition(parts | {"python_tag": python_tag}),
+                )
+                for condition in conditions:
+                    platform = condition.split("-", 2)[-1]
+                    if (python_tag, platform) not in specific and wheels.get(f"cp3x-abi3-{platform}") != wheel_target:
+                        wheels[condition] = wheel_target
 
         # Source distribution fallback
         sdist = next(iter(self.sdist), None)
-        if not wheels and not sdist:
+        if not wheels and not sdist and not levels:
             raise NotImplementedError(TODO_MESSAGE.format(self))
 
         # Convert to a Starlark list of selection pairs
@@ -315,10 +594,7 @@ class Package:
             (f'"@ofiuco//python/platforms:{condition}"', wheel_target) for condition, wheel_target in wheels.items()
         ] + [('"//conditions:default"', f'"@{sdist}//:sdist"' if sdist else None)]
 
-        if len(conditions) == 1:
-            return [conditions[0][1]]
-
-        return ["select({", *[f"  {condition}: {target}," for condition, target in conditions], "})"]
+        return conditions
 
     @staticmethod
     def _escape(s):
@@ -375,6 +651,11 @@ class Package:
             for entry in files
             if entry["hash"].startswith("sha256:")
         }
+        sizes = {
+            entry["hash"].removeprefix("sha256:"): size
+            for entry in files
+            if entry["hash"].startswith("sha256:") and (size := entry.get("size")) is not None
+        }
 
         return Package(
             name=package.get("name"),
@@ -383,23 +664,29 @@ class Package:
             extras=extras,
             source=source,
             urls=urls,
+            sizes=sizes,
             files={normalize_basename(url): hsh for hsh, url in urls.items()},
         )
 
-    def repr_extras(self):
+    def repr_extras(self, label=local_label):
         return "\n".join(
             f"""
 py_library(
   name = "{self.name}[{name}]",
-  deps = [":{self.name}", {deps}],
+  deps = ["{label(self.name)}", {deps}],
   visibility = ["//visibility:public"],
 )
 """
             for name, extra_deps in self.extras.items()
-            if (deps := ", ".join([f'":{dep}"' for dep in extra_deps]))
+            if (deps := ", ".join([f'"{label(dep)}"' for dep in sorted(extra_deps)]))
         )
 
-    def repr(self, platforms, generate_extras, enable_rust):
+    def target_names(self, generate_extras):
+        """Names of the package target and of the extras targets which are generated by repr."""
+        extras = [f"{self.name}[{name}]" for name, deps in self.extras.items() if deps] if generate_extras else []
+        return [self.name, *extras]
+
+    def repr(self, platforms, generate_extras, enable_rust, label=local_label, selects=None):
         sep = "\n  "
         attr_sep = "," + sep
         markers = {
@@ -415,13 +702,22 @@ py_library(
             if not dependency_info.get("extras", []):
                 direct_dependencies.append(dependency_name)
 
-        dependencies = [f":{name}" for name in sorted(set(direct_dependencies))] + sorted(set(self.extra_dependencies))
+        dependencies = [label(name) for name in sorted(set(direct_dependencies))] + sorted(set(self.extra_dependencies))
+        libc_versions = get_libc_versions(platforms)
 
         attrs = {
             "description": [f'"""{self.description}"""'] if self.description else [],
-            "package": self.select if self.version else [],
+            "package": (
+                (selects or self).render_select(self.get_select_conditions(libc_versions)) if self.version else []
+            ),
+            "variants": self.render_variants(self.get_variant_conditions(libc_versions, get_cpu_levels(platforms))),
             "deps": (["[", *(f'  "{name}",' for name in dependencies), "]"] if dependencies else []),
             "markers": ([f'"""{self._escape(json.dumps(markers))}"""'] if markers else []),
+            "resolved_markers": (
+                [f"'{json.dumps(resolved, separators=(',', ':'))}'"]
+                if markers and (resolved := resolve_markers(markers, platforms))
+                else []
+            ),
             "platforms": (
                 [
                     "{",
@@ -436,9 +732,7 @@ py_library(
             "visibility": ['["//visibility:public"]'],
         }
 
-        # https://pypi.org/search/?c=Programming+Language+%3A%3A+Rust
-        rust_package_index = bisect.bisect_left(RUST_PACKAGES, self.name)
-        rust_package = rust_package_index < len(RUST_PACKAGES) and RUST_PACKAGES[rust_package_index] == self.name
+        rust_package = self.name.removesuffix(CYCLE_MEMBER_SUFFIX) in get_rust_packages()
         package_rule = "rust_package" if rust_package else "package"
 
         return f"""
@@ -446,18 +740,167 @@ py_library(
   name = "{self.name}",
   {attr_sep.join((attr + " = " + sep.join(value)) for attr, value in attrs.items() if value)},
 )
-{self.repr_extras() if generate_extras and self.extras else ""}
+{self.repr_extras(label) if generate_extras and self.extras else ""}
 """
 
 
-def remove_cycles(dependency_graph, path, u, removed_edges):
-    for v in dependency_graph[u]:
-        if v in removed_edges[u]:
-            pass
-        elif v in path:
-            removed_edges[u].add(v)
-        else:
-            remove_cycles(dependency_graph, path + [u], v, removed_edges)
+@dataclass(slots=True)
+class Alias(Package):
+    actual: str = ""
+
+    def repr(self, platforms, generate_extras, enable_rust, label=local_label, selects=None):
+        return f"""
+alias(
+  name = "{self.name}",
+  actual = "{label(self.actual)}",
+  visibility = ["//visibility:public"],
+)
+{self.repr_extras(label) if generate_extras and self.extras else ""}
+"""
+
+
+class ConditionGroups:
+    """Lists of select conditions shared by packages in one BUILD file.
+
+    Conditions mapped to the same target, like back-compatible macOS versions, are rendered as a dict
+    comprehension over a shared condition list, so selects have one line per distinct target.
+    """
+
+    def __init__(self):
+        self.groups = {}
+
+    def render_select(self, conditions):
+        if len(conditions) <= 1:
+            return [target for _, target in conditions]
+
+        targets = defaultdict(list)
+        for condition, target in conditions:
+            targets[target].append(condition)
+
+        inline, shared = [], []
+        for target, group in targets.items():
+            if len(group) == 1:
+                inline.append(f"  {group[0]}: {target},")
+            else:
+                name = self.groups.setdefault(tuple(group), f"_CONDITIONS_{len(self.groups)}")
+                shared.append(f"  | {{condition: {target} for condition in {name}}}")
+
+        if not shared:
+            return ["select({", *inline, "})"]
+        return ["select(", "  {", *(f"  {line}" for line in inline), "  }", *shared, ")"]
+
+    def collect(self, packages, platforms):
+        """Definitions of condition lists used by selects of packages.
+
+        Lists are collected in a first pass over packages before stanzas are rendered,
+        so stanzas can still be written one by one after the definitions.
+        """
+        libc_versions = get_libc_versions(platforms)
+        for package in packages:
+            if package.version and not isinstance(package, Alias):
+                self.render_select(package.get_select_conditions(libc_versions))
+
+        definitions = []
+        for group, name in self.groups.items():
+            conditions = "".join(f"  {condition},\n" for condition in group)
+            definitions.append(f"\n{name} = [\n{conditions}]\n")
+        return "".join(definitions)
+
+
+def remove_cycles(dependency_graph):
+    """Find back edges and strongly connected components of the dependency graph.
+
+    Iterative Tarjan's algorithm where nodes and successors are visited in the dependency graph order.
+    An edge to a node on the current depth-first search path is a back edge, so removal of all back edges
+    breaks all dependency cycles. Each node and edge is visited once.
+
+    Returns:
+        The tuple of removed back edges per node and the list of strongly connected components.
+    """
+    removed_edges = defaultdict(set)
+    components = []
+    index, lowlink = {}, {}
+    component_stack, on_stack, on_path = [], set(), set()
+
+    def visit(u):
+        index[u] = lowlink[u] = len(index)
+        component_stack.append(u)
+        on_stack.add(u)
+        on_path.add(u)
+        return u, iter(dependency_graph.get(u, ()))
+
+    for root in dependency_graph:
+        if root in index:
+            continue
+
+        path = [visit(root)]
+        while path:
+            u, successors = path[-1]
+            for v in successors:
+                if v in on_path:
+                    removed_edges[u].add(v)
+                    lowlink[u] = min(lowlink[u], index[v])
+                elif v not in index:
+                    path.append(visit(v))
+                    break
+                elif v in on_stack:
+                    lowlink[u] = min(lowlink[u], index[v])
+            else:
+                path.pop()
+                on_path.remove(u)
+                if path:
+                    parent, _ = path[-1]
+                    lowlink[parent] = min(lowlink[parent], lowlink[u])
+
+                if lowlink[u] == index[u]:
+                    component = []
+                    while (v := component_stack.pop()) != u:
+                        component.append(v)
+                        on_stack.remove(v)
+                    component.append(u)
+                    on_stack.remove(u)
+                    components.append(component[::-1])
+
+    return removed_edges, components
+
+
+def find_collapsible_cycles(packages):
+    """Map names of packages in cycles of unconditional dependencies to names of aggregate targets."""
+    unconditional_graph = {
+        package.name: sorted(
+            name for name, attr in package.dependencies.items() if not attr.get("markers", attr.get("marker"))
+        )
+        for package in sorted(packages, key=attrgetter("name"))
+    }
+    _, components = remove_cycles(unconditional_graph)
+    return {
+        name: f"{min(component)}{CYCLE_SUFFIX}" for component in components if len(component) > 1 for name in component
+    }
+
+
+def collapse_cycles(packages, cycles):
+    """Replace packages in each dependency cycle by an aggregate target.
+
+    Members of a cycle are renamed with a suffix and lose dependencies inside the cycle. The aggregate target
+    depends on all members and the original package names become aliases of the aggregate, so every member
+    provides the whole runtime closure of the cycle.
+    """
+    collapsed = []
+    members = defaultdict(list)
+    for package in packages:
+        if cycle_name := cycles.get(package.name):
+            collapsed.append(Alias(name=package.name, extras=package.extras, actual=cycle_name))
+            package.name = f"{package.name}{CYCLE_MEMBER_SUFFIX}"
+            package.extras = {}
+            package.dependencies = {
+                name: attr for name, attr in package.dependencies.items() if cycles.get(name) != cycle_name
+            }
+            members[cycle_name].append(package.name)
+
+    for cycle_name, names in members.items():
+        collapsed.append(Package(name=cycle_name, dependencies={name: {} for name in names}))
+
+    return packages + collapsed
 
 
 def find_unique_name(names, suffix):
@@ -484,41 +927,238 @@ def load_uv_locked_packages(lock_file, project_root):
     return [Package.from_uv_lock(package, project_root) for package in conf.get("package", [])]
 
 
-async def get_simple_index(name, index_url):
-    """Legacy (PEP 503) and JSON-based (PEP 691) index parser."""
-    package_index_url = f"{index_url}/{name}/"
+def load_locked_packages(lock_file, project_root):
+    if lock_file.name == "poetry.lock":
+        return load_poetry_locked_packages(lock_file, project_root)
+    elif re.match(r"uv.*\.lock", lock_file.name):
+        return load_uv_locked_packages(lock_file, project_root)
+    else:
+        print(re.match(r"uv.*\.lock", lock_file.name))
+        raise RuntimeError(f"unknown input type {lock_file.name}")
 
-    async def fetch():
-        request = urllib.request.Request(package_index_url, headers={"Accept": f"{PYPI_SIMPLE_MIME_TYPE},text/html"})
-        with urllib.request.urlopen(request) as response:
-            if response.getcode() != 200:
-                raise RuntimeError(f"Unexpected status code: {response.getcode()} for {package_index_url}")
-
-            if response.headers.get_content_type() == PYPI_SIMPLE_MIME_TYPE:
-                return {
-                    sha256: url
-                    for e in json.loads(response.read()).get("files", [])
-                    if (sha256 := e.get("hashes", {}).get("sha256")) is not None and (url := e.get("url")) is not None
-                }
 
-            # Fallback to HTML index
-            urls = {}
+@dataclass(frozen=True)
+class IndexResponse:
+    status: int
+    url: str
+    headers: Any
+    body: bytes
+
+    @property
+    def content_type(self):
+        return self.headers.get_content_type()
+
+
+class IndexClient:
+    """Simple API client with bounded concurrency and keep-alive connections per index host."""
+
+    REDIRECT_CODES = {301, 302, 303, 307, 308}
+    MAX_REDIRECTS = 5
+
+    def __init__(self, max_in_flight=16, timeout=60.0, cache_dir=None):
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+        self.cache_dir = cache_dir
+        self.executor = None
+        self.connections = defaultdict(list)
+        self.pages = {}
+
+    def __enter__(self):
+        import concurrent.futures
+        import threading
+        import urllib.request
+
+        # Proxies are read from the environment once as the lookup scans all variables
+        self.proxies = urllib.request.getproxies()
+        self.lock = threading.Lock()
+        self.executor = concurrent.futures.ThreadPoolExecutor(self.max_in_flight, thread_name_prefix="index")
+        return self
 
-            class LinkParser(html.parser.HTMLParser):
-                SHA256_FRAGMENT_RE = re.compile(r"#sha256=([0-9a-fA-F]{64})")
+    def __exit__(self, *exc_info):
+        self.executor.shutdown()
+        for connection in itertools.chain.from_iterable(self.connections.values()):
+            connection.close()
+        self.connections.clear()
 
-                def handle_starttag(self, tag, attrs):
-                    if tag == "a" and (href := dict(attrs).get("href")) and (m := self.SHA256_FRAGMENT_RE.search(href)):
-                        urls[m.group(1)] = urllib.parse.urljoin(response.geturl(), href)
+    async def get(self, url, headers):
+        import asyncio
 
-            html_data = response.read().decode()
-            LinkParser().feed(html_data)
-            return urls
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self.request, url, headers)
 
-    return await fetch()
+    def request(self, url, headers):
+        """Blocking GET request with redirects, runs in the executor threads."""
+        import urllib.request
 
+        headers = {"Accept-Encoding": "gzip", **headers}
+        for _ in range(self.MAX_REDIRECTS + 1):
+            parts = urllib.parse.urlsplit(url)
+            proxied = parts.scheme in self.proxies and not urllib.request.proxy_bypass(parts.hostname)
+            if parts.scheme not in ("http", "https") or proxied:
+                # Proxies and other schemes are handled by urllib without connections reuse
+                return self.decompress(self.urlopen(url, headers))
 
-async def read_package_files(package):
+            response = self.request_pooled(parts, headers)
+            if response.status not in self.REDIRECT_CODES or not (location := response.headers.get("Location")):
+                return self.decompress(IndexResponse(response.status, url, response.headers, response.body))
+            url = urllib.parse.urljoin(url, location)
+
+        raise RuntimeError(f"Too many redirects for {url}")
+
+    @staticmethod
+    def decompress(response):
+        if response.headers.get("Content-Encoding", "").lower() != "gzip":
+            return response
+
+        import zlib
+
+        body = zlib.decompress(response.body, wbits=zlib.MAX_WBITS | 16)
+        return IndexResponse(response.status, response.url, response.headers, body)
+
+    def urlopen(self, url, headers):
+        import urllib.error
+        import urllib.request
+
+        try:
+            with urllib.request.urlopen(urllib.request.Request(url, headers=headers), timeout=self.timeout) as response:
+                return IndexResponse(response.getcode(), response.geturl(), response.headers, response.read())
+        except urllib.error.HTTPError as error:
+            # Non-2xx statuses are checked by callers, e.g. 304 for conditional requests
+            return IndexResponse(error.code, error.geturl(), error.headers, error.read())
+
+    def request_pooled(self, parts, headers):
+        import http.client
+
+        key = (parts.scheme, parts.netloc)
+        path = urllib.parse.urlunsplit(("", "", parts.path or "/", parts.query, ""))
+        while True:
+            with self.lock:
+                connection = self.connections[key].pop() if self.connections[key] else None
+
+            reused = connection is not None
+            if not reused:
+                connection_type = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+                connection = connection_type(parts.netloc, timeout=self.timeout)
+
+            try:
+                connection.request("GET", path, headers=headers)
+                response = connection.getresponse()
+                body = response.read()
+            except (http.client.HTTPException, ConnectionError):
+                connection.close()
+                if reused:
+                    # Idle connection was closed by the server, retry with a new one
+                    continue
+                raise
+            except BaseException:
+                connection.close()
+                raise
+
+            if response.will_close:
+                connection.close()
+            else:
+                with self.lock:
+                    self.connections[key].append(connection)
+
+            return IndexResponse(response.status, parts.geturl(), response.headers, body)
+
+
+def iter_simple_json_files(data):
+    """File entries of a PEP 691 project page decoded one by one instead of the whole document."""
+    text = data.decode()
+    if (files := SIMPLE_JSON_FILES_RE.search(text)) is None:
+        yield from json.loads(text).get("files", [])
+        return
+
+    decoder = json.JSONDecoder()
+    position = files.end()
+    while not text.startswith("]", position := SIMPLE_JSON_SEPARATOR_RE.match(text, position).end()):
+        entry, position = decoder.raw_decode(text, position)
+        yield entry
+
+
+def iter_simple_html_files(data, base_url):
+    """Pairs of sha256 and URL of anchors in a PEP 503 project page scanned in a single pass over bytes."""
+    import html
+
+    for anchor in SIMPLE_HTML_ANCHOR_RE.finditer(data):
+        href = anchor.group(anchor.lastindex)
+        if sha256 := SHA256_FRAGMENT_RE.search(href):
+            href = href.decode()
+            href = html.unescape(href) if "&" in href else href
+            # Absolute links are common and joining them dominates the parsing time
+            absolute = href.startswith(("https://", "http://"))
+            yield sha256.group(1).decode(), href if absolute else urllib.parse.urljoin(base_url, href)
+
+
+def parse_simple_index(response):
+    """Legacy (PEP 503) and JSON-based (PEP 691) index parser."""
+    if response.content_type == PYPI_SIMPLE_MIME_TYPE:
+        return {
+            sha256: url
+            for e in iter_simple_json_files(response.body)
+            if (sha256 := e.get("hashes", {}).get("sha256")) is not None and (url := e.get("url")) is not None
+        }
+
+    # Fallback to HTML index
+    return dict(iter_simple_html_files(response.body, response.url))
+
+
+async def fetch_simple_index(name, index_url, client, required):
+    """Files of the project index page revalidated against the cached page if the client has a cache directory.
+
+    Files are immutable, so the cached page is used without a request if it has all required sha256 hashes.
+    Returns the files map and a flag if the page was requested from the index.
+    """
+    package_index_url = f"{index_url}/{name}/"
+    headers = {"Accept": f"{PYPI_SIMPLE_MIME_TYPE},text/html"}
+
+    cache_key = hashlib.sha256(f"index:{package_index_url}".encode()).hexdigest() if client.cache_dir else None
+    cached = None
+    if cache_key and (entry := read_cache(client.cache_dir, cache_key)):
+        # Truncated or corrupt entries are cache misses and are replaced by the fetched page
+        with contextlib.suppress(ValueError):
+            cached = json.loads(entry)
+    if cached:
+        if required <= cached["urls"].keys():
+            return cached["urls"], False
+        if cached["etag"]:
+            headers["If-None-Match"] = cached["etag"]
+        if cached["last_modified"]:
+            headers["If-Modified-Since"] = cached["last_modified"]
+
+    response = await client.get(package_index_url, headers)
+    if response.status == 304 and cached:
+        return cached["urls"], True
+    if response.status != 200:
+        raise RuntimeError(f"Unexpected status code: {response.status} for {package_index_url}")
+
+    urls = parse_simple_index(response)
+    if cache_key:
+        etag, last_modified = response.headers.get("ETag"), response.headers.get("Last-Modified")
+        write_cache(client.cache_dir, cache_key, json.dumps(dict(etag=etag, last_modified=last_modified, urls=urls)))
+
+    return urls, True
+
+
+async def get_simple_index(name, index_url, client, required=frozenset()):
+    """Lookups of the same project page share one in-flight fetch memoized in the client for the whole run."""
+    import asyncio
+
+    key = (index_url, name)
+    if (page := client.pages.get(key)) is None:
+        page = client.pages[key] = asyncio.ensure_future(fetch_simple_index(name, index_url, client, required))
+
+    urls, requested = await page
+    if not requested and not required <= urls.keys():
+        # Cached page was sufficient for the first lookup but not for this one
+        if client.pages[key] is page:
+            client.pages[key] = asyncio.ensure_future(fetch_simple_index(name, index_url, client, required))
+        urls, _ = await client.pages[key]
+
+    return urls
+
+
+async def read_package_files(package, client):
     # Get files from a server with Simple API
     # Ref: https://packaging.python.org/en/latest/specifications/simple-repository-api/#
     index_url = "https://pypi.org/simple"
@@ -577,7 +1217,8 @@ filegroup(
                 raise NotImplementedError(TODO_MESSAGE.format(package.source))
 
     # Python packagesindex index
-    urls = urls or package.urls or await get_simple_index(package.name, index_url)
+    required = {*package.wheels.values(), *package.sdist.values()}
+    urls = urls or package.urls or await get_simple_index(package.name, index_url, client, required)
 
     repositories = [
         # Binary wheels
@@ -606,17 +1247,55 @@ filegroup(
     return repositories
 
 
-def generate_files(locked_packages):
-    async def _inner():
-        tasks = [asyncio.create_task(read_package_files(package)) for package in locked_packages]
+def get_repository_names(package):
+    """Names of repositories which are generated by read_package_files for the package."""
+    if package.source and package.source.type == SourceType.virtual:
+        return []
+    if package.source and package.source.type not in {SourceType.legacy, SourceType.url}:
+        return [package.name]
+    return [*package.wheels, *package.sdist]
+
+
+def get_files_key(package):
+    return package.source, package.files, package.urls
+
+
+def split_files(locked_packages, files):
+    """Repositories of the previous output per package name and version or None if the output does not match."""
+    previous, entries = {}, iter(files)
+    for package in locked_packages:
+        names = get_repository_names(package)
+        repositories = list(itertools.islice(entries, len(names)))
+        if [repository["name"] for repository in repositories] != names:
+            return None
+        previous[(package.name, package.version)] = (get_files_key(package), repositories)
+    return None if next(entries, None) else previous
+
+
+def generate_files(locked_packages, max_in_flight=16, timeout=60.0, cache_dir=None, previous=None, profile=None):
+    import asyncio
+
+    previous = previous or {}
+    profile = profile or Profile(enabled=False)
+
+    async def _read(package, client):
+        # Reuse repositories of unchanged packages from the previous output
+        files_key, repositories = previous.get((package.name, package.version), (None, None))
+        if repositories is not None and files_key == get_files_key(package):
+            profile.count(reused_files=1)
+            return repositories
+        return await read_package_files(package, client)
+
+    async def _inner(client):
+        tasks = [asyncio.create_task(_read(package, client)) for package in locked_packages]
         results = await asyncio.gather(*tasks)
         return [repo for result in results for repo in result]
 
-    repositories = asyncio.run(_inner())
-    return json.dumps(repositories, indent=2)
+    with IndexClient(max_in_flight, timeout, cache_dir) as client:
+        return asyncio.run(_inner(client))
 
 
-def generate_packages(locked_packages, platforms, generate_extras, enable_rust, extra_deps):
+def prepare_packages(locked_packages, extra_deps, collapse=False):
     # Process packages by first grouping by package names
     packages = []
     name_getter = attrgetter("name")
@@ -638,21 +1317,31 @@ def generate_packages(locked_packages, platforms, generate_extras, enable_rust,
                 )
             )
 
+    # Find cycles of unconditional dependencies which can be collapsed into single targets
+    cycles = find_collapsible_cycles(packages) if collapse else {}
+
+    def node(name):
+        return cycles.get(name, name)
+
     # Find back edges which form dependency cycles
-    removed_edges = defaultdict(set)
-    dependency_graph = {
-        package.name: sorted(set(package.dependencies.keys())) for package in sorted(packages, key=name_getter)
-    }
-    for start in dependency_graph:
-        remove_cycles(dependency_graph, [], start, removed_edges)
+    dependency_graph = defaultdict(set)
+    for package in sorted(packages, key=name_getter):
+        dependency_graph[node(package.name)].update(
+            node(name) for name in package.dependencies if name not in cycles or node(name) != node(package.name)
+        )
+    dependency_graph = {name: sorted(dependencies) for name, dependencies in dependency_graph.items()}
+    removed_edges, _ = remove_cycles(dependency_graph)
 
     # Remove back edges to break dependency cycles
     for package in packages:
         package.dependencies = {
-            name: attr for name, attr in package.dependencies.items() if name not in removed_edges[package.name]
+            name: attr
+            for name, attr in package.dependencies.items()
+            if node(name) not in removed_edges.get(node(package.name), ())
         }
 
     # Append extra dependencies to packages
+    package_names = {package.name for package in packages}
     for package in packages:
         if extra_deps and (extra := extra_deps.get(package.name)):
             if isinstance(extra, str):
@@ -660,9 +1349,13 @@ def generate_packages(locked_packages, platforms, generate_extras, enable_rust,
             elif isinstance(extra, list):
                 package.extra_dependencies.extend(extra)
 
-        if (type_shadow := f"types-{package.name}") in dependency_graph:
+        if (type_shadow := f"types-{package.name}") in package_names:
             package.dependencies[type_shadow] = {}
 
+    # Collapse dependency cycles into aggregate targets
+    if cycles:
+        packages = collapse_cycles(packages, cycles)
+
     # Generate synthetic targets
     # :_*all contains all non-versioned packages unconditionally
     all_packages = [package.name for package in packages if "@" not in package.name]
@@ -673,8 +1366,840 @@ def generate_packages(locked_packages, platforms, generate_extras, enable_rust,
         )
     )
 
-    # Print packages
-    return "".join(package.repr(platforms, generate_extras, enable_rust) for package in packages)
+    return packages
+
+
+def split_stanzas(packages, build_file):
+    """Stanzas of the previous output per prepared package name or None if the output does not match."""
+    starts = [m.start() for m in STANZA_RE.finditer(build_file)]
+    if not starts or starts[0] != 0 or len(starts) != len(packages):
+        return None
+
+    previous = {}
+    for package, start, end in zip(packages, starts, starts[1:] + [len(build_file)], strict=True):
+        stanza = build_file[start:end]
+        if STANZA_RE.match(stanza)[1] != package.name:
+            return None
+        previous[package.name] = (package, stanza)
+    return previous
+
+
+def load_previous(args, project_root, fingerprint):
+    """Repositories and stanzas of unchanged packages from the previous lock file and output.
+
+    The previous output is used only if it has the same fingerprint of arguments and parser sources.
+    """
+    output = json.loads(args.previous_output.read_text())
+    if output.get("fingerprint") != fingerprint:
+        print("Previous output is generated with different arguments or parser", file=sys.stderr)
+        return {}, {}
+
+    locked_packages = load_locked_packages(args.previous_lock, project_root)
+    if args.prune_unreachable:
+        project_dependencies = load_project_dependencies(args.project_file) if args.project_file else set()
+        locked_packages = prune_unreachable(locked_packages, args.platforms, project_dependencies) or locked_packages
+    if args.prune_files:
+        prune_files(locked_packages, args.platforms)
+
+    # Files must be split first as prepare_packages renames ambiguous packages
+    previous_files = split_files(locked_packages, output["files"])
+    packages = prepare_packages(locked_packages, args.deps, args.collapse_cycles)
+    previous_stanzas = split_stanzas(packages, output["packages"])
+
+    return previous_files or {}, previous_stanzas or {}
+
+
+def generate_packages(
+    locked_packages,
+    platforms,
+    generate_extras,
+    enable_rust,
+    extra_deps,
+    collapse=False,
+    profile=None,
+    previous=None,
+    share_selects=False,
+):
+    profile = profile or Profile(enabled=False)
+    with profile.phase("prepare"):
+        packages = prepare_packages(locked_packages, extra_deps, collapse)
+    profile.count(targets=len(packages))
+
+    # Yield stanzas one by one to write packages incrementally
+    previous = previous or {}
+    selects = ConditionGroups() if share_selects else None
+    if selects:
+        with profile.phase("selects"):
+            definitions = selects.collect(packages, platforms)
+        yield definitions
+
+    for package in packages:
+        previous_package, stanza = previous.get(package.name, (None, None))
+        if stanza is not None and previous_package == package:
+            profile.count(reused_stanzas=1)
+        else:
+            with profile.phase("repr"):
+                stanza = package.repr(platforms, generate_extras, enable_rust, selects=selects)
+        yield stanza
+
+
+@functools.cache
+def is_compatible_platform(wheel_platform, platform_tags):
+    """Check if any of dot-separated wheel platform tags is supported by a platform with the given tags tuple."""
+
+    def macosx(tag):
+        m = WHEEL_PLATFORM_MACOSX_RE.match(tag)
+        return ((int(m["major"]), int(m["minor"])), m["arch"]) if m else None
+
+    supported = [(tag, *parse_wheel_platforms(tag), macosx(tag)) for tag in platform_tags]
+    for tag, wheel in zip(wheel_platform.split("."), parse_wheel_platforms(wheel_platform), strict=True):
+        if tag == "any":
+            return True
+        if wheel_macosx := macosx(tag):
+            wheel_macosx_arches = (wheel_macosx[1], *MACOSX_FAT_ARCHES.get(wheel_macosx[1], ()))
+        for supported_tag, platform, platform_macosx in supported:
+            if tag == supported_tag:
+                return True
+            if (
+                wheel.libc
+                and (wheel.libc, wheel.arch) == (platform.libc, platform.arch)
+                and wheel.version <= platform.version
+            ):
+                return True
+            if (
+                wheel_macosx
+                and platform_macosx
+                and platform_macosx[1] in wheel_macosx_arches
+                and wheel_macosx[0] <= platform_macosx[0]
+            ):
+                return True
+    return False
+
+
+@functools.cache
+def get_platform_libc_versions(platform):
+    """Libc versions per (libc, arch) of glibc_version and musl_version keys of a platform JSON string.
+
+    Architectures are taken from Linux platform tags and from platform_machine.
+    """
+    try:
+        values = json.loads(platform)
+    except json.JSONDecodeError:
+        return {}
+    if not isinstance(values, dict):
+        return {}
+
+    arches = {wheel.arch for tag in values.get("platform_tags", ()) for wheel in parse_wheel_platforms(tag)}
+    if machine := values.get("platform_machine"):
+        arches.add({"arm64": "aarch64", "AMD64": "x86_64"}.get(machine, machine))
+    arches.discard(None)
+
+    versions = {}
+    for libc in ("glibc", "musl"):
+        if (version := parse_marker_version(str(values.get(f"{libc}_version", "")))) and len(version) == 2:
+            versions.update({(libc, arch): version for arch in arches})
+    return versions
+
+
+@functools.cache
+def get_platform_libc_floors(platform):
+    """Libc versions per (libc, arch) supported by a Linux platform JSON string.
+
+    Versions are glibc_version and musl_version keys, otherwise GLIBC_VERSION and MUSL_VERSION
+    or newer versions of Linux platform tags. Linux platforms without tags support both libc kinds.
+    """
+    try:
+        values = json.loads(platform)
+    except json.JSONDecodeError:
+        return {}
+    if not isinstance(values, dict):
+        return {}
+
+    defaults = {"glibc": GLIBC_VERSION, "musl": MUSL_VERSION}
+    versions = {}
+    for tag in values.get("platform_tags", ()):
+        for wheel in parse_wheel_platforms(tag):
+            if wheel.libc and wheel.arch:
+                key = (wheel.libc, wheel.arch)
+                versions[key] = max(wheel.version, versions.get(key, defaults[wheel.libc]))
+
+    machine = values.get("platform_machine")
+    linux = values.get("sys_platform") == "linux" or values.get("platform_system") == "Linux"
+    if not versions and linux and machine:
+        arch = {"arm64": "aarch64", "AMD64": "x86_64"}.get(machine, machine)
+        versions = {(libc, arch): version for libc, version in defaults.items()}
+    return versions | get_platform_libc_versions(platform)
+
+
+def get_libc_versions(platforms):
+    """Oldest libc versions per (libc, arch) of platforms, so selected wheels can be used at all platforms.
+
+    Platforms without glibc_version or musl_version are included with versions of get_platform_libc_floors.
+    """
+    versions = {}
+    for value in (platforms or {}).values():
+        for key, version in get_platform_libc_floors(value).items():
+            versions[key] = min(version, versions.get(key, version))
+    return versions
+
+
+def get_platform_tags(platforms):
+    """Tuples of platform tags per platform name for platforms with platform_tags and libc version tags."""
+    platform_tags = {}
+    for name, value in (platforms or {}).items():
+        if tags := json.loads(value).get("platform_tags"):
+            libc_tags = [
+                f"{'manylinux' if libc == 'glibc' else 'musllinux'}_{major}_{minor}_{arch}"
+                for (libc, arch), (major, minor) in get_platform_libc_versions(value).items()
+            ]
+            platform_tags[name] = tuple(tags) + tuple(tag for tag in libc_tags if tag not in tags)
+    return platform_tags
+
+
+def prune_files(locked_packages, platforms):
+    """Remove files of index packages which can not be selected at any of platforms.
+
+    Wheels are kept if Package.select accepts the Python tag and any platform supports the platform tag.
+    Source distributions are kept if there is no wheel for any platform. Files of packages without files
+    for platforms are kept. Returns numbers of kept and all files.
+    """
+    supported = set(itertools.chain.from_iterable(get_platform_tags(platforms).values()))
+    if not supported:
+        return None
+
+    supported = tuple(sorted(supported))
+    kept, total = 0, 0
+    for package in locked_packages:
+        total += len(package.files)
+        if package.source and package.source.type != SourceType.legacy:
+            kept += len(package.files)
+            continue
+
+        wheels = {
+            f"{wheel}.whl": tag.platform
+            for wheel in package.wheels
+            if (tag := parse_wheel_tag(wheel))
+            and (tag.python_tag.startswith("cp3") or ("py3" in tag.python_tag.split(".")))
+            and is_compatible_platform(tag.platform, supported)
+        }
+        sdist = set() if "any" in wheels.values() else {f"{name}.tar.gz" for name in package.sdist}
+        if files := {name: sha256 for name, sha256 in package.files.items() if name in wheels or name in sdist}:
+            package.files = files
+        kept += len(package.files)
+
+    return kept, total
+
+
+@functools.cache
+def parse_marker(marker):
+    """Marker expression tree of nested ("or" | "and", operands) and ("compare", operator, lhs, rhs) tuples.
+
+    Operands of comparisons are ("variable", name) or ("string", value) tuples. Returns None for invalid markers.
+    """
+    tokens, position = [], 0
+    while position < len(marker.rstrip()):
+        if not (m := MARKER_TOKEN_RE.match(marker, position)) or m.end() == position:
+            return None
+        tokens.append((m.lastgroup, m[m.lastgroup]))
+        position = m.end()
+    tokens.append((None, None))
+
+    index = 0
+
+    def peek():
+        return tokens[index]
+
+    def take():
+        nonlocal index
+        index += 1
+        return tokens[index - 1]
+
+    def expression(keyword="or"):
+        operands = [expression("and") if keyword == "or" else atom()]
+        while peek() == ("keyword", keyword):
+            take()
+            operands.append(expression("and") if keyword == "or" else atom())
+        return operands[0] if len(operands) == 1 else (keyword, tuple(operands))
+
+    def operand():
+        kind, value = take()
+        if kind == "string":
+            return ("string", value[1:-1])
+        if kind == "variable":
+            return ("variable", value)
+        raise ValueError(marker)
+
+    def atom():
+        if peek() == ("parenthesis", "("):
+            take()
+            result = expression()
+            if take() != ("parenthesis", ")"):
+                raise ValueError(marker)
+            return result
+        lhs = operand()
+        kind, operator = take()
+        if kind != "operator":
+            raise ValueError(marker)
+        return ("compare", " ".join(operator.split()), lhs, operand())
+
+    try:
+        result = expression()
+        return result if peek() == (None, None) else None
+    except ValueError:
+        return None
+
+
+def parse_marker_version(version):
+    if re.fullmatch(r"\d+(\.\d+)*", version):
+        return tuple(int(part) for part in version.split("."))
+    return None
+
+
+def compare_marker_values(operator, lhs, rhs, version):
+    """Comparison result of marker values with versions compared as numbers or None if it can not be decided."""
+    match operator:
+        case "in":
+            return lhs in rhs
+        case "not in":
+            return lhs not in rhs
+        case "===":
+            return lhs == rhs
+    if version and operator in {"==", "!="} and rhs.endswith(".*"):
+        result = lhs == rhs[:-2] or lhs.startswith(rhs[:-1])
+        return result if operator == "==" else not result
+    if version and (lhs_version := parse_marker_version(lhs)) and (rhs_version := parse_marker_version(rhs)):
+        # Versions are compared with zero padding, so 3.12 == 3.12.0
+        size = max(len(lhs_version), len(rhs_version))
+        lhs, rhs = lhs_version + (0,) * (size - len(lhs_version)), rhs_version + (0,) * (size - len(rhs_version))
+    elif operator not in {"==", "!="}:
+        return None
+
+    match operator:
+        case "==":
+            return lhs == rhs
+        case "!=":
+            return lhs != rhs
+        case "<":
+            return lhs < rhs
+        case "<=":
+            return lhs <= rhs
+        case ">":
+            return lhs > rhs
+        case ">=":
+            return lhs >= rhs
+        case "~=":
+            prefix = len(rhs_version) - 1
+            return prefix > 0 and lhs >= rhs and lhs[:prefix] == rhs[:prefix]
+    return None
+
+
+def evaluate_marker(marker, environment):
+    """Three-valued evaluation of a parsed marker: True, False or None if some variables are unknown."""
+    if marker is None:
+        return None
+
+    kind = marker[0]
+    if kind == "compare":
+        _, operator, lhs, rhs = marker
+        values = [environment.get(value) if kind == "variable" else value for kind, value in (lhs, rhs)]
+        if None in values:
+            return None
+        version = any(kind == "variable" and value in MARKER_VERSION_VARIABLES for kind, value in (lhs, rhs))
+        return compare_marker_values(operator, *values, version)
+
+    results = [evaluate_marker(operand, environment) for operand in marker[1]]
+    if kind == "and":
+        return False if False in results else None if None in results else True
+    return True if True in results else None if None in results else False
+
+
+@functools.cache
+def get_marker_environment(platform):
+    """Marker environment of a platform JSON string with string values or None if it is not a JSON object.
+
+    Variables which are not set in the platform are unknown.
+    """
+    try:
+        values = json.loads(platform)
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(values, dict):
+        return None
+
+    environment = {"implementation_name": "cpython", "platform_python_implementation": "CPython"}
+    environment.update({key: value for key, value in values.items() if isinstance(value, str)})
+    return environment
+
+
+def get_marker_environments(platforms):
+    """Marker environments of platforms, variables which are not set are unknown."""
+    return [environment for value in (platforms or {}).values() if (environment := get_marker_environment(value))]
+
+
+def resolve_markers(markers, platforms):
+    """Dependency marker values per platform name as booleans or as mappings of Python versions to booleans.
+
+    Markers which can not be decided for a platform or a Python version are omitted.
+    """
+    resolved = {}
+    for platform, value in (platforms or {}).items():
+        if (environment := get_marker_environment(value)) is None:
+            continue
+        values = {}
+        for name, marker in markers.items():
+            if not isinstance(marker, str) or (parsed := parse_marker(marker)) is None:
+                continue
+            if (result := evaluate_marker(parsed, environment)) is not None:
+                values[name] = result
+            elif "python_version" not in environment:
+                versions = {
+                    version: result
+                    for version in MARKER_PYTHON_VERSIONS
+                    if (result := evaluate_marker(parsed, environment | {"python_version": version})) is not None
+                }
+                if versions:
+                    values[name] = versions
+        if values:
+            resolved[platform] = values
+    return resolved
+
+
+def load_project_dependencies(project_file):
+    """Normalized names of direct dependencies in PEP 621, dependency groups, Poetry and uv tables of pyproject file."""
+    with project_file.open("rb") as project_handle:
+        project = tomllib.load(project_handle)
+
+    project_table = project.get("project", {})
+    poetry = project.get("tool", {}).get("poetry", {})
+    specifications = itertools.chain(
+        project_table.get("dependencies", []),
+        *project_table.get("optional-dependencies", {}).values(),
+        *project.get("dependency-groups", {}).values(),
+        project.get("tool", {}).get("uv", {}).get("dev-dependencies", []),
+    )
+    names = itertools.chain(
+        (m[0] for spec in specifications if isinstance(spec, str) and (m := re.match(r"[\w.-]+", spec))),
+        poetry.get("dependencies", {}),
+        poetry.get("dev-dependencies", {}),
+        *(group.get("dependencies", {}) for group in poetry.get("group", {}).values()),
+    )
+    return {normalize_target_name(name) for name in names if name != "python"}
+
+
+def prune_unreachable(locked_packages, platforms, project_dependencies=()):
+    """Replace packages which are not reachable from root packages at any of platforms by stub packages.
+
+    Roots are project dependencies and packages of dependency cycles without dependents, they are reached with all
+    extras. Dependencies are followed if markers of the dependency and of the dependency package are not false
+    for a platform environment. Returns the list of packages or None if platforms have no marker environments.
+    """
+    environments = get_marker_environments(platforms)
+    if not environments:
+        return None
+
+    packages = defaultdict(list)
+    for package in locked_packages:
+        packages[package.name].append(package)
+
+    def split_extras(name):
+        name, _, extras = name.partition("[")
+        return name, extras.rstrip("]").split(",") if extras else []
+
+    # Strongly connected components of dependencies without dependents outside the component
+    dependency_graph = {
+        name: sorted({dependency for package in group for dependency in package.dependencies})
+        for name, group in packages.items()
+    }
+    _, components = remove_cycles(dependency_graph)
+    component_index = {name: index for index, component in enumerate(components) for name in component}
+    dependents = {
+        component_index[dependency]
+        for name, dependencies in dependency_graph.items()
+        for dependency in dependencies
+        if component_index.get(dependency, component_index[name]) != component_index[name]
+    }
+    roots = {name for name, index in component_index.items() if index not in dependents and name in packages}
+    roots.update(name for name in project_dependencies if name in packages)
+    roots = [(name, list(itertools.chain.from_iterable(p.extras for p in packages[name]))) for name in sorted(roots)]
+
+    reachable = set()
+    for environment in environments:
+
+        def included(marker, environment=environment):
+            if isinstance(marker, dict):
+                # Poetry markers per dependency group
+                return any(map(included, marker.values()))
+            return not marker or evaluate_marker(parse_marker(marker), environment) is not False
+
+        # Depth-first traversal of dependencies and extras dependencies from root packages
+        reached, stack = {}, list(roots)
+        while stack:
+            name, extras = stack.pop()
+            known = reached.get(name)
+            if known is not None and known.issuperset(extras):
+                continue
+            reached[name] = (known or set()) | set(extras)
+            for package in packages.get(name, ()):
+                if not included(package.markers):
+                    continue
+                if known is None:
+                    stack.extend(
+                        (dependency, attr.get("extras", attr.get("extra", [])))
+                        for dependency, attr in package.dependencies.items()
+                        if included(attr.get("markers", attr.get("marker")))
+                    )
+                for extra in set(extras) - (known or set()):
+                    stack.extend(split_extras(dependency) for dependency in package.extras.get(extra, ()))
+
+        reachable.update(name for name in reached if any(included(p.markers) for p in packages.get(name, ())))
+
+    # Stubs of unreachable packages have no files and dependencies
+    return [
+        package
+        if package.name in reachable
+        else Package(
+            name=package.name,
+            version=package.version,
+            description="Not used at configured platforms",
+            extras=package.extras,
+            source=Source(type=SourceType.virtual),
+        )
+        for package in locked_packages
+    ]
+
+
+def generate_stats(locked_packages, platforms, extra_deps, collapse=False):
+    """Structural statistics of locked packages as a JSON object."""
+
+    def summary(values):
+        values = sorted(values)
+        return {
+            "count": len(values),
+            "total": sum(values),
+            "max": values[-1] if values else 0,
+            "median": values[len(values) // 2] if values else 0,
+        }
+
+    platform_tags = get_platform_tags(platforms)
+
+    sources = defaultdict(int)
+    wheels, conditions, extras, extras_dependencies = [], [], [], []
+    sdist_only, sdist_fallback = [], {name: [] for name in platform_tags}
+    download_bytes = {name: 0 for name in platform_tags}
+    for package in locked_packages:
+        sources[package.source.type if package.source else "pypi"] += 1
+        extras.append(len(package.extras))
+        extras_dependencies.extend(len(deps) for deps in package.extras.values())
+        if not package.version or package.source and package.source.type not in {SourceType.legacy, SourceType.url}:
+            continue
+
+        wheels.append(len(package.wheels))
+        select = package.select
+        conditions.append(len(select) - 2 if select[0] == "select({" else 1)
+        sdist = next(iter(package.sdist), None)
+        if sdist and not package.wheels:
+            sdist_only.append(package.name)
+
+        # Wheels with supported Python tags per platform
+        tags = [
+            (wheel, tag.platform)
+            for wheel in package.wheels
+            if (tag := parse_wheel_tag(wheel))
+            and (tag.python_tag.startswith("cp3") or ("py3" in tag.python_tag.split(".")))
+        ]
+        for name, supported in platform_tags.items():
+            compatible = [wheel for wheel, platform in tags if is_compatible_platform(platform, supported)]
+            if not compatible and sdist:
+                sdist_fallback[name].append(package.name)
+            sizes = [package.sizes.get(package.wheels[wheel], 0) for wheel in compatible]
+            download_bytes[name] += max(sizes) if sizes else package.sizes.get(package.sdist.get(sdist), 0)
+
+    # Edges removed to break dependency cycles and edges inside collapsed cycles are missing in dependencies
+    # of prepared packages, which are copied as prepare_packages renames packages and replaces dependencies
+    prepared = copy.deepcopy(locked_packages)
+    dependencies = [set(package.dependencies) for package in prepared]
+    cycles = {
+        f"{package.name}{CYCLE_MEMBER_SUFFIX}": package.actual
+        for package in prepare_packages(prepared, extra_deps, collapse)
+        if isinstance(package, Alias)
+    }
+    removed_edges, collapsed_edges = [], []
+    for package, names in zip(prepared, dependencies, strict=True):
+        cycle = cycles.get(package.name)
+        name = package.name.removesuffix(CYCLE_MEMBER_SUFFIX) if cycle else package.name
+        for dependency in sorted(names - package.dependencies.keys()):
+            collapsed = cycle is not None and cycles.get(f"{dependency}{CYCLE_MEMBER_SUFFIX}") == cycle
+            (collapsed_edges if collapsed else removed_edges).append([name, dependency])
+
+    return {
+        "packages": len(locked_packages),
+        "sources": dict(sorted(sources.items())),
+        "wheels": summary(wheels),
+        "select_conditions": summary(conditions),
+        "sdist_only": sorted(sdist_only),
+        "sdist_fallback": {name: sorted(names) for name, names in sdist_fallback.items()},
+        "removed_edges": sorted(removed_edges),
+        "collapsed_edges": sorted(collapsed_edges),
+        "extras": summary(extras),
+        "extras_dependencies": summary(extras_dependencies),
+        "files": len({file for package in locked_packages for file in package.files}),
+        "recorded_bytes": sum(size for package in locked_packages for size in package.sizes.values()),
+        "download_bytes": download_bytes,
+    }
+
+
+def generate_shards(
+    locked_packages,
+    platforms,
+    generate_extras,
+    enable_rust,
+    extra_deps,
+    collapse=False,
+    shards=1,
+    profile=None,
+    share_selects=False,
+):
+    """Root aliases stanzas and stanzas grouped by shard package paths."""
+    profile = profile or Profile(enabled=False)
+    with profile.phase("prepare"):
+        packages = prepare_packages(locked_packages, extra_deps, collapse)
+    profile.count(targets=len(packages))
+
+    def aliases():
+        for package in packages:
+            for name in package.target_names(generate_extras):
+                yield f"""
+alias(
+  name = "{name}",
+  actual = "//{get_shard(name, shards)}:{name}",
+  visibility = ["//visibility:public"],
+)
+"""
+
+    def stanzas(shard, group):
+        def label(name):
+            return f":{name}" if (name_shard := get_shard(name, shards)) == shard else f"//{name_shard}:{name}"
+
+        selects = ConditionGroups() if share_selects else None
+        if selects:
+            group = list(group)
+            with profile.phase("selects"):
+                definitions = selects.collect(group, platforms)
+            yield definitions
+
+        for package in group:
+            with profile.phase("repr"):
+                stanza = package.repr(platforms, generate_extras, enable_rust, label, selects)
+            yield stanza
+
+    shard_getter = itemgetter(0)
+    groups = itertools.groupby(
+        sorted(((get_shard(package.name, shards), package) for package in packages), key=shard_getter),
+        key=shard_getter,
+    )
+    return aliases(), ((shard, stanzas(shard, map(itemgetter(1), group))) for shard, group in groups)
+
+
+def generate_all(files, stanzas, shards=None, fingerprint=None):
+    """JSON object with fingerprint, files, packages and shards keys as json.dumps with indent=2.
+
+    Strings are encoded by parts and keys with None values are omitted.
+    """
+    header = {key: value for key, value in {"fingerprint": fingerprint, "files": files}.items() if value is not None}
+    if header:
+        yield json.dumps(header, indent=2).removesuffix("\n}")
+        yield ',\n  "packages": "'
+    else:
+        yield '{\n  "packages": "'
+    for stanza in stanzas:
+        yield json.dumps(stanza)[1:-1]
+    yield '"'
+
+    if shards is not None:
+        yield ',\n  "shards": {'
+        separator = "\n    "
+        for shard, shard_stanzas in shards:
+            yield f'{separator}{json.dumps(shard)}: "'
+            for stanza in shard_stanzas:
+                yield json.dumps(stanza)[1:-1]
+            yield '"'
+            separator = ",\n    "
+        yield "\n  }" if separator != "\n    " else "}"
+
+    yield "\n}"
+
+
+def get_cache_key(args, project_root, lock=True, output=None):
+    """Content-addressed key of the parser output for the lock file and arguments.
+
+    Without lock the key is a fingerprint of arguments and parser sources for incremental outputs,
+    output overrides the output kind of arguments.
+    """
+
+    def digest(path):
+        return hashlib.sha256(path.read_bytes()).hexdigest() if path else None
+
+    parser_path = Path(__file__)
+    key = {
+        "parser": [digest(parser_path), digest(parser_path.parent / "rust_packages.gz")],
+        "lock": [args.input_file.name, digest(args.input_file)] if lock else None,
+        "project": [os.fspath(project_root.resolve()), digest(args.project_file)],
+        "platforms": args.platforms,
+        "deps": args.deps,
+        "generate_extras": args.generate_extras,
+        "enable_rust": args.enable_rust,
+        "collapse_cycles": args.collapse_cycles,
+        "prune_files": args.prune_files,
+        "prune_unreachable": args.prune_unreachable,
+        "output": output or args.output,
+        "shards": args.shards,
+        "share_selects": args.share_selects,
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+def read_cache(cache_dir, key, json_output=False):
+    """Cached output or None for missing, empty and, with json_output, unparsable entries."""
+    entry = cache_dir / key[:2] / key
+    try:
+        output = entry.read_text()
+
+        # Refresh access time for the age-based eviction, but do not recreate concurrently evicted entries
+        os.utime(entry)
+    except FileNotFoundError:
+        return None
+
+    if json_output:
+        try:
+            json.loads(output)
+        except ValueError:
+            return None
+    return output or None
+
+
+def read_cached_packages(cache_dir, key, shards):
+    """Packages output extracted from the cached output=all entry or None for misses."""
+    if (output := read_cache(cache_dir, key)) is None:
+        return None
+    try:
+        parsed = json.loads(output)
+    except ValueError:
+        return None
+    if not shards:
+        return parsed["packages"]
+    return json.dumps({"packages": parsed["packages"], "shards": parsed["shards"]}, indent=2)
+
+
+@contextlib.contextmanager
+def open_cache(cache_dir, key, max_size=None, max_age=None):
+    """Writable cache entry which is stored only if the context exits without exceptions."""
+    entry = cache_dir / key[:2] / key
+    entry.parent.mkdir(parents=True, exist_ok=True)
+    temporary = entry.with_name(f"{key}.{os.getpid()}.tmp")
+    try:
+        # Entries are written to a temporary file and atomically replaced, so readers never see partial outputs
+        with temporary.open("w") as output:
+            yield output
+        os.replace(temporary, entry)
+    finally:
+        temporary.unlink(missing_ok=True)
+
+    if max_size is not None and max_age is not None:
+        evict_cache(cache_dir, max_size, max_age)
+
+
+def write_cache(cache_dir, key, output, max_size=None, max_age=None):
+    with open_cache(cache_dir, key, max_size, max_age) as entry:
+        entry.write(output)
+
+
+def evict_cache(cache_dir, max_size, max_age):
+    """Remove cache entries older than max_age seconds and then the least recently used entries above max_size bytes."""
+    entries = []
+    now = time.time()
+    for entry in cache_dir.glob("*/*"):
+        if entry.suffix == ".tmp":
+            continue
+        try:
+            stat = entry.stat()
+            if now - stat.st_mtime > max_age:
+                entry.unlink()
+            else:
+                entries.append((stat.st_mtime, stat.st_size, entry))
+        except FileNotFoundError:
+            # Concurrently evicted entry
+            pass
+
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, entry in sorted(entries, key=itemgetter(0)):
+        if total_size <= max_size:
+            break
+        entry.unlink(missing_ok=True)
+        total_size -= size
+
+
+class Profile:
+    """Accumulated wall-clock and CPU timings of lock parser phases with optional cProfile statistics."""
+
+    def __init__(self, enabled=True, functions=0):
+        self.enabled = enabled
+        self.functions = functions
+        self.phases = {}
+        self.counts = {}
+        self.start = (time.perf_counter(), time.process_time())
+        self.profiler = None
+        if enabled and functions:
+            import cProfile
+
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    def phase(self, name):
+        return self._phase(name) if self.enabled else contextlib.nullcontext()
+
+    @contextlib.contextmanager
+    def _phase(self, name):
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            timing = self.phases.setdefault(name, {"wall": 0.0, "cpu": 0.0, "calls": 0})
+            timing["wall"] += time.perf_counter() - wall
+            timing["cpu"] += time.process_time() - cpu
+            timing["calls"] += 1
+
+    def count(self, **counts):
+        for name, value in counts.items():
+            self.counts[name] = self.counts.get(name, 0) + value
+
+    def to_json(self):
+        wall, cpu = self.start
+        result = {
+            "phases": self.phases,
+            "counts": self.counts,
+            "total": {"wall": time.perf_counter() - wall, "cpu": time.process_time() - cpu},
+        }
+        if self.profiler:
+            import pstats
+
+            self.profiler.disable()
+            stats = pstats.Stats(self.profiler).stats
+            top = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[: self.functions]
+            result["functions"] = [
+                {
+                    "function": f"{path}:{line}({function})",
+                    "calls": calls,
+                    "primitive_calls": primitive_calls,
+                    "total": total,
+                    "cumulative": cumulative,
+                }
+                for (path, line, function), (primitive_calls, calls, total, cumulative, _) in top
+            ]
+        return result
+
+    def dump(self, path, **info):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(info | self.to_json(), indent=2))
 
 
 def main(argv=None):
@@ -685,29 +2210,168 @@ def main(argv=None):
     parser.add_argument("--deps", type=json.loads, help="JSON string of extra dependencies")
     parser.add_argument("--generate_extras", default=True, action=argparse.BooleanOptionalAction)
     parser.add_argument("--enable_rust", default=False, action=argparse.BooleanOptionalAction)
+    parser.add_argument("--collapse_cycles", default=False, action=argparse.BooleanOptionalAction)
     parser.add_argument("--project_file", type=Path)
-    parser.add_argument("--output", type=str.lower, choices=["packages", "files"])
+    parser.add_argument("--output", type=str.lower, choices=["packages", "files", "all", "stats"])
+    parser.add_argument("--index_max_in_flight", type=int, default=16, help="Maximal number of index requests")
+    parser.add_argument("--index_timeout", type=float, default=60.0, help="Index request timeout in seconds")
+    parser.add_argument("--cache_dir", type=Path, help="Directory of the content-addressed output cache")
+    parser.add_argument("--cache_max_size", type=int, default=512 * 1024 * 1024, help="Cache size limit in bytes")
+    parser.add_argument("--cache_max_age", type=int, default=30 * 24 * 3600, help="Cache entry age limit in seconds")
+    parser.add_argument(
+        "--prune_files",
+        default=False,
+        action=argparse.BooleanOptionalAction,
+        help="Remove wheels and sdists which can not be selected at any platform with platform_tags",
+    )
+    parser.add_argument(
+        "--prune_unreachable",
+        default=False,
+        action=argparse.BooleanOptionalAction,
+        help="Replace packages which are not reachable at any platform by stubs",
+    )
+    parser.add_argument("--shards", type=int, default=0, help="Number of packages with targets in the output")
+    parser.add_argument(
+        "--share_selects",
+        default=False,
+        action=argparse.BooleanOptionalAction,
+        help="Render selects with condition lists shared by packages in one BUILD file",
+    )
+    parser.add_argument("--previous_lock", type=Path, help="Path to the previous lock file")
+    parser.add_argument("--previous_output", type=Path, help="Path to the output=all JSON for the previous lock file")
+    parser.add_argument("--profile", type=Path, help="Path of the JSON file with per-phase timings and counts")
+    parser.add_argument("--profile_functions", type=int, default=0, help="Number of cProfile functions in the profile")
 
     args = parser.parse_args(argv)
+    profile = Profile(enabled=bool(args.profile), functions=args.profile_functions)
+    try:
+        _main(args, profile)
+    finally:
+        if args.profile:
+            profile.dump(args.profile, lock=os.fspath(args.input_file), output=args.output or "packages")
 
-    # Load locked data
+
+def _main(args, profile):
     project_root = args.project_file.resolve().parent if args.project_file else Path()
-    if args.input_file.name == "poetry.lock":
-        locked_packages = load_poetry_locked_packages(args.input_file, project_root)
-    elif re.match(r"uv.*\.lock", args.input_file.name):
-        locked_packages = load_uv_locked_packages(args.input_file, project_root)
-    else:
-        print(re.match(r"uv.*\.lock", args.input_file.name))
-        raise RuntimeError(f"unknown input type {args.input_file.name}")
+
+    # Return cached output for unchanged inputs
+    cache_key = get_cache_key(args, project_root) if args.cache_dir else None
+    with profile.phase("cache"):
+        json_output = args.output in {"files", "all", "stats"} or bool(args.shards)
+        output = read_cache(args.cache_dir, cache_key, json_output) if cache_key else None
+
+        # The module extension caches output=all for the same arguments, so the repository rule does not parse again
+        if output is None and cache_key and args.output in {None, "packages"}:
+            all_key = get_cache_key(args, project_root, output="all")
+            output = read_cached_packages(args.cache_dir, all_key, args.shards)
+    profile.count(cache_hits=output is not None)
+    if output is not None:
+        sys.stdout.write(output)
+        return
+
+    # Load locked data
+    with profile.phase("load"):
+        locked_packages = load_locked_packages(args.input_file, project_root)
+    if profile.enabled:
+        profile.count(
+            packages=len(locked_packages),
+            wheels=sum(len(package.wheels) for package in locked_packages),
+            sdists=sum(len(package.sdist) for package in locked_packages),
+        )
+
+    # Replace packages which are not used at the given platforms by stubs
+    if args.prune_unreachable:
+        project_dependencies = load_project_dependencies(args.project_file) if args.project_file else set()
+        if (pruned := prune_unreachable(locked_packages, args.platforms, project_dependencies)) is not None:
+            stubs = sum(
+                package is not pruned_package for package, pruned_package in zip(locked_packages, pruned, strict=True)
+            )
+            locked_packages = pruned
+            profile.count(stubs=stubs)
+            print(f"Replaced {stubs} of {len(locked_packages)} packages by stubs", file=sys.stderr)
+
+    # Remove files which are not used at the given platforms
+    if args.prune_files and (pruned := prune_files(locked_packages, args.platforms)):
+        kept, total = pruned
+        profile.count(kept_files=kept, pruned_files=total - kept)
+        print(f"Pruned {total - kept} of {total} files ({(total - kept) / (total or 1):.1%})", file=sys.stderr)
+
+    # Load unchanged repositories and stanzas from the previous output with the same fingerprint
+    previous_files, previous_stanzas = {}, {}
+    fingerprint = get_cache_key(args, project_root, lock=False) if args.output == "all" else None
+    incremental = args.output == "all" and not args.shards and not args.share_selects
+    if args.previous_lock and args.previous_output and incremental:
+        with profile.phase("previous"):
+            previous_files, previous_stanzas = load_previous(args, project_root, fingerprint)
 
     # Process data
+    def files():
+        with profile.phase("files"):
+            repositories = generate_files(
+                locked_packages,
+                args.index_max_in_flight,
+                args.index_timeout,
+                args.cache_dir,
+                previous_files,
+                profile,
+            )
+        profile.count(repositories=len(repositories))
+        return repositories
+
+    def packages():
+        return generate_packages(
+            locked_packages,
+            args.platforms,
+            args.generate_extras,
+            args.enable_rust,
+            args.deps,
+            args.collapse_cycles,
+            profile,
+            previous_stanzas,
+            args.share_selects,
+        )
+
+    def shards():
+        return generate_shards(
+            locked_packages,
+            args.platforms,
+            args.generate_extras,
+            args.enable_rust,
+            args.deps,
+            args.collapse_cycles,
+            args.shards,
+            profile,
+            args.share_selects,
+        )
+
     if args.output == "files":
-        output = generate_files(locked_packages)
+        output = [json.dumps(files(), indent=2)]
+    elif args.output == "stats":
+        with profile.phase("stats"):
+            stats = generate_stats(locked_packages, args.platforms, args.deps, args.collapse_cycles)
+        output = [json.dumps(stats, indent=2)]
+    elif args.output == "all":
+        # Single pass output for both the module extension and the repository rule,
+        # files must be generated first as generate_packages renames ambiguous packages
+        if args.shards:
+            output = generate_all(files(), *shards(), fingerprint=fingerprint)
+        else:
+            output = generate_all(files(), packages(), fingerprint=fingerprint)
+    elif args.shards:
+        output = generate_all(None, *shards())
     else:
-        output = generate_packages(locked_packages, args.platforms, args.generate_extras, args.enable_rust, args.deps)
-
-    # Print output
-    sys.stdout.write(output)
+        output = packages()
+
+    # Print output incrementally through the buffered stdout and the cache entry
+    with contextlib.ExitStack() as stack:
+        outputs = [sys.stdout]
+        if cache_key:
+            entry = open_cache(args.cache_dir, cache_key, args.cache_max_size, args.cache_max_age)
+            outputs.append(stack.enter_context(entry))
+        for chunk in output:
+            with profile.phase("write"):
+                for stream in outputs:
+                    stream.write(chunk)
 
 
 if __name__ == "__main__":
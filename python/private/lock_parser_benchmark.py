@@ -0,0 +1,470 @@
+"""Benchmarks of lock parser phases on synthetic and recorded lock files.
+
+Synthetic Poetry and uv locks are generated for every size with a local simple index serving their files.
+Timings and peak memory of every phase are compared with the stored baseline and regressions fail the run.
+Timings are stored relative to a calibration workload timed on the same machine, so the baseline can be
+compared on other machines. Output sizes and peak memory are machine-independent.
+Simple index parsers are compared with reference html.parser and json.loads implementations on large pages.
+
+Usage:
+    bazel run //python/private:lock_parser_benchmark -- --sizes=1000,5000 --update_baseline
+"""
+
+import argparse
+import contextlib
+import email.message
+import hashlib
+import html.parser
+import http.server
+import json
+import multiprocessing
+import os
+import random
+import re
+import socket
+import sys
+import tempfile
+import time
+import tomllib
+import tracemalloc
+import urllib.parse
+from dataclasses import dataclass
+from pathlib import Path
+
+import python.private.lock_parser as parser
+
+ASSETS = Path(__file__).parent / "assets"
+BASELINE = ASSETS / "lock_parser_benchmark.json"
+RECORDED_LOCKS = ["airflow/poetry.lock", "torch/poetry.lock", "sphinx/uv.lock"]
+
+PLATFORMS = {
+    "aarch64-apple-darwin": json.dumps({"platform_tags": ["macosx_11_0_arm64"], "sys_platform": "darwin"}),
+    "aarch64-unknown-linux-gnu": json.dumps({"platform_tags": ["manylinux_2_28_aarch64"], "sys_platform": "linux"}),
+    "x86_64-pc-windows-msvc": json.dumps({"platform_tags": ["win_amd64"], "sys_platform": "win32"}),
+    "x86_64-unknown-linux-gnu": json.dumps({"platform_tags": ["manylinux_2_17_x86_64"], "sys_platform": "linux"}),
+}
+
+WHEEL_TAGS = [
+    "cp312-cp312-manylinux_2_17_x86_64.manylinux2014_x86_64",
+    "cp312-cp312-manylinux_2_28_aarch64",
+    "cp312-cp312-musllinux_1_2_x86_64",
+    "cp312-cp312-macosx_11_0_arm64",
+    "cp312-cp312-win_amd64",
+    "cp313-cp313-manylinux_2_17_x86_64.manylinux2014_x86_64",
+    "cp313-cp313-manylinux_2_28_aarch64",
+    "cp313-cp313-musllinux_1_2_x86_64",
+    "cp313-cp313-macosx_11_0_arm64",
+    "cp313-cp313-win_amd64",
+    "cp39-abi3-manylinux_2_17_x86_64",
+    "cp39-abi3-macosx_10_12_universal2",
+]
+
+MARKERS = [
+    ("python_version", ">=", "3.12"),
+    ("sys_platform", "==", "linux"),
+    ("platform_machine", "==", "x86_64"),
+    ("os_name", "!=", "nt"),
+    ("implementation_name", "==", "cpython"),
+    ("platform_system", "!=", "Windows"),
+]
+
+
+@dataclass(frozen=True)
+class Synthetic:
+    """Parameters of a synthetic lock file."""
+
+    count: int
+    wheels: int = 6
+    binary: float = 0.3
+    dependencies: int = 3
+    cycles: float = 0.05
+    markers: int = 2
+    seed: int = 0
+
+    def packages(self):
+        """Package names, versions, files with sha256 hashes and dependencies with markers.
+
+        Dependencies point to packages with greater indices, so only the back edges added
+        with the cycles probability form dependency cycles.
+        """
+        rng = random.Random(self.seed)
+        for index in range(self.count):
+            name, version = f"package{index}", f"1.{index % 7}.{index % 11}"
+            binary = rng.random() < self.binary
+            tags = rng.sample(WHEEL_TAGS, min(self.wheels, len(WHEEL_TAGS))) if binary else ["py3-none-any"]
+            files = [f"{name}-{version}-{tag}.whl" for tag in tags] + [f"{name}-{version}.tar.gz"]
+            files = [(file, hashlib.sha256(file.encode()).hexdigest()) for file in files]
+
+            targets = {rng.randrange(index + 1, self.count) for _ in range(self.dependencies) if index + 1 < self.count}
+            if index and rng.random() < self.cycles:
+                targets.add(rng.randrange(index))
+
+            dependencies = []
+            for target in sorted(targets):
+                marker = [rng.choice(MARKERS) for _ in range(rng.randrange(self.markers + 1))]
+                dependencies.append((f"package{target}", marker))
+
+            yield name, version, files, dependencies
+
+
+def write_poetry_lock(path, synthetic, index_url=None):
+    with open(path, "w") as lock:
+        for name, version, files, dependencies in synthetic.packages():
+            lock.write(
+                f'[[package]]\nname = "{name}"\nversion = "{version}"\ndescription = "Synthetic {name}"\n'
+                'optional = false\npython-versions = ">=3.9"\ngroups = ["main"]\nfiles = [\n'
+            )
+            lock.writelines(f'    {{file = "{file}", hash = "sha256:{sha256}"}},\n' for file, sha256 in files)
+            lock.write("]\n\n[package.dependencies]\n")
+            for dependency, marker in dependencies:
+                if marker:
+                    markers = json.dumps(" and ".join(f'{key} {op} "{value}"' for key, op, value in marker))
+                    lock.write(f'{dependency} = {{version = ">=1.0", markers = {markers}}}\n')
+                else:
+                    lock.write(f'{dependency} = ">=1.0"\n')
+            if index_url:
+                lock.write(f'\n[package.source]\ntype = "legacy"\nurl = "{index_url}"\nreference = "synthetic"\n')
+            lock.write("\n")
+
+
+def write_uv_lock(path, synthetic, index_url):
+    with open(path, "w") as lock:
+        lock.write('version = 1\nrevision = 3\nrequires-python = ">=3.12"\n\n')
+        for name, version, files, dependencies in synthetic.packages():
+            lock.write(f'[[package]]\nname = "{name}"\nversion = "{version}"\n')
+            lock.write(f'source = {{ registry = "{index_url}" }}\n')
+            if dependencies:
+                lock.write("dependencies = [\n")
+                for dependency, marker in dependencies:
+                    markers = " and ".join(f"{key} {op} '{value}'" for key, op, value in marker)
+                    marker = f', marker = "{markers}"' if marker else ""
+                    lock.write(f'    {{ name = "{dependency}"{marker} }},\n')
+                lock.write("]\n")
+
+            (sdist, sdist_sha256), wheels = files[-1], files[:-1]
+            url = f"{index_url.removesuffix('/simple')}/files"
+            lock.write(f'sdist = {{ url = "{url}/{sdist}", hash = "sha256:{sdist_sha256}", size = 1 }}\n')
+            lock.write("wheels = [\n")
+            for file, sha256 in wheels:
+                lock.write(f'    {{ url = "{url}/{file}", hash = "sha256:{sha256}", size = 1 }},\n')
+            lock.write("]\n\n")
+
+
+def _serve_index(synthetic, connection):
+    pages = {}
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def setup(self):
+            super().setup()
+            # Headers and body are sent separately, avoid delayed acknowledgements of keep-alive connections
+            self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        def do_GET(self):
+            body = pages[self.path.strip("/").split("/")[-1]]
+            self.send_response(200)
+            self.send_header("Content-Type", parser.PYPI_SIMPLE_MIME_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    with http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler) as server:
+        url = f"http://127.0.0.1:{server.server_address[1]}/files"
+        for name, _, files, _ in synthetic.packages():
+            files = [{"url": f"{url}/{file}", "hashes": {"sha256": sha256}} for file, sha256 in files]
+            pages[name] = json.dumps({"meta": {"api-version": "1.1"}, "name": name, "files": files}).encode()
+
+        connection.send(server.server_address[1])
+        server.serve_forever()
+
+
+@contextlib.contextmanager
+def serve_index(synthetic):
+    """Local PEP 691 simple index with files of the synthetic packages.
+
+    The index runs in a separate process to not compete with the lock parser threads for the interpreter lock.
+    """
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(target=_serve_index, args=(synthetic, sender), daemon=True)
+    process.start()
+    try:
+        yield f"http://127.0.0.1:{receiver.recv()}/simple"
+    finally:
+        process.terminate()
+        process.join()
+
+
+def run_phases(lock_path, files=True):
+    """Seconds of every lock parser phase for the lock file."""
+    timings = {}
+
+    @contextlib.contextmanager
+    def phase(name):
+        start = time.perf_counter()
+        yield
+        timings[name] = time.perf_counter() - start
+
+    from_lock = parser.Package.from_poetry_lock if lock_path.name == "poetry.lock" else parser.Package.from_uv_lock
+    with phase("toml"), lock_path.open("rb") as lock:
+        conf = tomllib.load(lock)
+    with phase("from_lock"):
+        packages = [from_lock(package, Path()) for package in conf.get("package", [])]
+    with phase("select"):
+        for package in packages:
+            _ = package.select
+    dependency_graph = {package.name: sorted(package.dependencies) for package in packages}
+    with phase("remove_cycles"):
+        parser.remove_cycles(dependency_graph)
+    if files:
+        # Files are generated before packages are renamed by the preparation
+        with phase("files"):
+            parser.generate_files(packages)
+    with phase("prepare"):
+        packages = parser.prepare_packages(packages, None)
+    with phase("repr"):
+        output_size = sum(len(package.repr(PLATFORMS, True, False)) for package in packages)
+
+    timings["total"] = sum(timings.values())
+    timings["output_size"] = output_size
+    return timings
+
+
+def run_scenario(lock_path, files=True, memory=True):
+    result = run_phases(lock_path, files)
+    if memory:
+        # Separate run as tracing slows down allocations
+        tracemalloc.start()
+        try:
+            run_phases(lock_path, files)
+            _, result["peak_memory"] = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    return result
+
+
+def run_benchmarks(sizes, synthetic_args, recorded=True, memory=True):
+    results = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for size in sizes:
+            synthetic = Synthetic(size, **synthetic_args)
+            with serve_index(synthetic) as index_url:
+                poetry_lock = Path(tmpdir) / "poetry.lock"
+                write_poetry_lock(poetry_lock, synthetic, index_url)
+                results[f"poetry-{size}"] = run_scenario(poetry_lock, memory=memory)
+
+                uv_lock = Path(tmpdir) / "uv.lock"
+                write_uv_lock(uv_lock, synthetic, index_url)
+                results[f"uv-{size}"] = run_scenario(uv_lock, memory=memory)
+
+    if recorded:
+        # Files of recorded locks are on public indexes and not fetched
+        for lock in RECORDED_LOCKS:
+            results[lock] = run_scenario(ASSETS / lock, files=False, memory=memory)
+
+    return results
+
+
+def parse_html_reference(data, base_url):
+    urls = {}
+
+    class LinkParser(html.parser.HTMLParser):
+        SHA256_FRAGMENT_RE = re.compile(r"#sha256=([0-9a-fA-F]{64})")
+
+        def handle_starttag(self, tag, attrs):
+            if tag == "a" and (href := dict(attrs).get("href")) and (m := self.SHA256_FRAGMENT_RE.search(href)):
+                urls[m.group(1)] = urllib.parse.urljoin(base_url, href)
+
+    LinkParser().feed(data.decode())
+    return urls
+
+
+def parse_json_reference(data, base_url):
+    return {
+        sha256: url
+        for e in json.loads(data).get("files", [])
+        if (sha256 := e.get("hashes", {}).get("sha256")) is not None and (url := e.get("url")) is not None
+    }
+
+
+def parse_simple_index(data, base_url, content_type):
+    headers = email.message.Message()
+    headers["Content-Type"] = content_type
+    return parser.parse_simple_index(parser.IndexResponse(200, base_url, headers, data))
+
+
+def simple_index_pages(repeat=20):
+    """Large simple index pages as tuples of scenario names, content types, page data and reference parsers.
+
+    Pages are recorded pytest pages with repeated files, the HTML page has also a relative upper case link.
+    """
+    page = (ASSETS / "pytest.html").read_bytes()
+    head, _, tail = page.partition(b"<a ")
+    anchors, _, tail = tail.rpartition(b"</a>")
+    anchors = b"<a " + anchors + b"</a>"
+    relative = b'<A class="file" HREF=\'../../packages/a.whl#sha256=' + b"0" * 64 + b"&amp;x=1'>a.whl</A>\n"
+    data = head + b"\n".join([anchors] * repeat) + relative + tail
+    yield "simple_index/html", "text/html", data, parse_html_reference
+
+    page = json.loads((ASSETS / "pytest.json").read_bytes())
+    page["files"] *= repeat
+    yield "simple_index/json", parser.PYPI_SIMPLE_MIME_TYPE, json.dumps(page).encode(), parse_json_reference
+
+
+def run_index_parsers(memory=True):
+    """Seconds and peak memory of simple index parsers and of reference parsers of the same pages."""
+    results = {}
+    base_url = "https://example.com/simple/pytest/"
+    for scenario, content_type, data, reference in simple_index_pages():
+        result = results[scenario] = {}
+        for name, function, args in [
+            ("reference", reference, (data, base_url)),
+            ("parse", parse_simple_index, (data, base_url, content_type)),
+        ]:
+            start = time.perf_counter()
+            function(*args)
+            result[name] = time.perf_counter() - start
+            if memory:
+                tracemalloc.start()
+                try:
+                    function(*args)
+                    _, result[f"{name}_peak_memory"] = tracemalloc.get_traced_memory()
+                finally:
+                    tracemalloc.stop()
+        result["size"] = len(data)
+    return results
+
+
+def is_timing(name):
+    return not name.endswith(("peak_memory", "size"))
+
+
+def calibrate(repeats=5):
+    """Seconds of a fixed workload of the standard library which scales with the machine speed."""
+    text = (ASSETS / "airflow/poetry.lock").read_text()
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        tomllib.loads(text)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def relative(results, calibration):
+    """Results with timings in units of the calibration workload."""
+    return {
+        scenario: {name: value / calibration if is_timing(name) else value for name, value in values.items()}
+        for scenario, values in results.items()
+    }
+
+
+def compare(results, baseline, tolerance, memory_tolerance, min_delta):
+    """Regressions of relative results with respect to the baseline as human-readable lines.
+
+    Timings and min_delta are in units of the calibration workload, sizes are compared with memory_tolerance.
+    """
+    regressions = []
+    for scenario, values in results.items():
+        for name, value in values.items():
+            if (expected := baseline.get(scenario, {}).get(name)) is None or name == "size":
+                continue
+            if name.endswith("peak_memory"):
+                if value > expected * memory_tolerance:
+                    regressions.append(f"{scenario} {name}: {value / 2**20:.1f}MiB > {expected / 2**20:.1f}MiB")
+            elif name.endswith("size"):
+                if value > expected * memory_tolerance:
+                    regressions.append(f"{scenario} {name}: {value} > {expected}")
+            elif value > expected * tolerance and value - expected > min_delta:
+                regressions.append(f"{scenario} {name}: {value:.2f} > {expected:.2f} calibration units")
+    return regressions
+
+
+def print_results(results, baseline, calibration=1.0, file=sys.stdout):
+    """Timings in milliseconds with ratios to relative baseline timings."""
+    phases = ["toml", "from_lock", "select", "remove_cycles", "files", "prepare", "repr", "total"]
+    print(f"{'scenario':<24}" + "".join(f"{phase:>14}" for phase in phases) + f"{'peak_memory':>14}", file=file)
+    for scenario, values in results.items():
+        expected = baseline.get(scenario, {})
+        cells = [
+            f"{values[phase] * 1000:.1f}ms"
+            + (f"/{values[phase] / calibration / expected[phase]:.2f}" if expected.get(phase) else "")
+            if phase in values
+            else "-"
+            for phase in phases
+        ]
+        peak = f"{values['peak_memory'] / 2**20:.1f}MiB" if "peak_memory" in values else "-"
+        print(f"{scenario:<24}" + "".join(f"{cell:>14}" for cell in cells) + f"{peak:>14}", file=file)
+
+
+def print_index_results(results, file=sys.stdout):
+    for scenario, values in results.items():
+        size = values["size"] / 2**20
+        line = f"{scenario:<24}{size:.1f}MiB: {size / values['reference']:.0f} -> {size / values['parse']:.0f}MiB/s"
+        if "parse_peak_memory" in values:
+            reference_peak, peak = values["reference_peak_memory"] / 2**20, values["parse_peak_memory"] / 2**20
+            line += f", peak {reference_peak:.1f} -> {peak:.1f}MiB"
+        print(line, file=file)
+
+
+def main(argv=None):
+    argparser = argparse.ArgumentParser(description="Benchmark lock parser phases.")
+    argparser.add_argument("--sizes", type=lambda s: [int(size) for size in s.split(",")], default=[1000, 5000, 20000])
+    argparser.add_argument("--wheels", type=int, default=6, help="Number of wheels of binary packages")
+    argparser.add_argument("--binary", type=float, default=0.3, help="Fraction of packages with binary wheels")
+    argparser.add_argument("--dependencies", type=int, default=3, help="Number of dependencies per package")
+    argparser.add_argument("--cycles", type=float, default=0.05, help="Probability of a cyclic dependency")
+    argparser.add_argument("--markers", type=int, default=2, help="Maximal number of marker clauses")
+    argparser.add_argument("--recorded", default=True, action=argparse.BooleanOptionalAction)
+    argparser.add_argument("--memory", default=True, action=argparse.BooleanOptionalAction)
+    argparser.add_argument("--baseline", type=Path, default=BASELINE)
+    argparser.add_argument("--update_baseline", default=False, action=argparse.BooleanOptionalAction)
+    argparser.add_argument("--tolerance", type=float, default=1.5, help="Allowed ratio of phase timings")
+    argparser.add_argument("--memory_tolerance", type=float, default=1.2, help="Allowed ratio of peak memory")
+    argparser.add_argument("--min_delta", type=float, default=0.01, help="Ignored timing regressions in seconds")
+    argparser.add_argument("--calibration_repeats", type=int, default=5, help="Repeats of the calibration workload")
+    argparser.add_argument("--output", type=Path, help="Path of the results JSON file")
+    args = argparser.parse_args(argv)
+
+    synthetic_args = dict(
+        wheels=args.wheels, binary=args.binary, dependencies=args.dependencies, cycles=args.cycles, markers=args.markers
+    )
+    calibration = calibrate(args.calibration_repeats)
+    results = run_benchmarks(args.sizes, synthetic_args, args.recorded, args.memory)
+    index_results = run_index_parsers(args.memory)
+
+    # Runs with bazel run are in the runfiles tree, so the default baseline is used from the workspace
+    baseline_path = args.baseline
+    if (workspace := os.environ.get("BUILD_WORKSPACE_DIRECTORY")) and baseline_path == BASELINE:
+        baseline_path = Path(workspace) / "python/private/assets" / BASELINE.name
+    baseline = json.loads(baseline_path.read_text()) if baseline_path.exists() else {}
+
+    print(f"calibration {calibration * 1000:.1f}ms")
+    print_results(results, baseline, calibration)
+    print_index_results(index_results)
+    results = relative(results | index_results, calibration)
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2, sort_keys=True) + "\n")
+
+    if args.update_baseline:
+        baseline_path.write_text(json.dumps(baseline | results, indent=2, sort_keys=True) + "\n")
+        return 0
+
+    # Simple index parsers must be faster than reference parsers at the same machine
+    regressions = [
+        f"{scenario} parse: {values['parse'] * 1000:.1f}ms > reference {values['reference'] * 1000:.1f}ms"
+        for scenario, values in index_results.items()
+        if scenario.endswith("html") and values["parse"] > values["reference"]
+    ]
+    min_delta = args.min_delta / calibration
+    if regressions := regressions + compare(results, baseline, args.tolerance, args.memory_tolerance, min_delta):
+        print("\nREGRESSIONS against " + os.fspath(baseline_path), *regressions, sep="\n  ", file=sys.stderr)
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
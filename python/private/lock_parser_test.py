@@ -1,15 +1,26 @@
 import asyncio
 import contextlib
+import email.message
+import gzip
+import hashlib
+import http.server
 import io
 import json
 import os
+import random
 import re
+import subprocess
+import sys
 import tempfile
+import threading
+import time
+import tracemalloc
 import unittest
 import unittest.mock
 from pathlib import Path
 
 import python.private.lock_parser as parser
+import python.private.lock_parser_benchmark as benchmark
 from python.private.lock_parser import WHEEL_RE, find_unique_name, main
 
 
@@ -94,11 +105,259 @@ class TestPoetryInstallSubcommand(unittest.TestCase):
         assert build_file.count(":apache-airflow-core") == 2, f"{build_file.count(':apache-airflow-core') = }"
         assert build_file.count(":apache-airflow-task-sdk") == 3, f"{build_file.count(':apache-airflow-task-sdk') = }"
 
+    def test_airflow_collapse_cycles(self):
+        with io.StringIO() as buffer, contextlib.redirect_stdout(buffer):
+            main([self.assets.format("airflow"), "--collapse_cycles"])
+            build_file = buffer.getvalue()
+
+        # Collect targets dependency graph
+        graph = {}
+        for stanza in re.findall(r"^\w+\(\n.*?^\)$", build_file, re.MULTILINE | re.DOTALL):
+            name = re.search(r'name = "([^"]+)"', stanza).group(1)
+            graph[name] = sorted(set(re.findall(r'[":]:([^"]+)"', stanza)))
+
+        assert graph["apache-airflow-core"] == graph["apache-airflow-task-sdk"] == ["apache-airflow-core@cycle"]
+        assert graph["apache-airflow-core@cycle"] == ["apache-airflow-core@package", "apache-airflow-task-sdk@package"]
+        assert "apache-airflow-core" in graph["all"] and "apache-airflow-core@cycle" not in graph["all"]
+
+        # Targets graph has no cycles
+        removed_edges, _ = parser.remove_cycles(graph)
+        assert not any(removed_edges.values()), removed_edges
+
+    def test_airflow_incremental(self):
+        lock = Path(self.assets.format("airflow")).read_text()
+        changed = lock.replace(
+            'description = "A database migration tool for SQLAlchemy."\n',
+            'description = "A database migration tool."\n',
+        ).replace('Mako = "*"\n', 'Mako = "*"\napache-airflow = "*"\n', 1)
+        changed = re.sub(r'\[\[package\]\]\nname = "unicodecsv".*?(?=\[\[package\]\])', "", changed, flags=re.DOTALL)
+        assert changed.count("[[package]]") == lock.count("[[package]]") - 1
+
+        with tempfile.TemporaryDirectory(dir=self.tmpdir) as tmpdir:
+            previous_lock, lock_path = Path(tmpdir, "previous", "poetry.lock"), Path(tmpdir, "poetry.lock")
+            previous_lock.parent.mkdir()
+            previous_lock.write_text(lock)
+            lock_path.write_text(changed)
+
+            outputs, profile = {}, Path(tmpdir, "profile.json")
+            platforms = json.dumps({"a": "b"})
+            for name, args in [
+                ("previous", [f"{previous_lock}", platforms]),
+                ("full", [f"{lock_path}", platforms]),
+                ("incremental", [f"{lock_path}", platforms, f"--previous_lock={previous_lock}"]),
+            ]:
+                with io.StringIO() as buffer, contextlib.redirect_stdout(buffer):
+                    main(args + ["--output=all", f"--previous_output={tmpdir}/previous.out", f"--profile={profile}"])
+                    outputs[name] = buffer.getvalue()
+                Path(tmpdir, f"{name}.out").write_text(outputs[name])
+
+            assert outputs["incremental"] == outputs["full"] != outputs["previous"]
+            counts = json.loads(profile.read_text())["counts"]
+            rendered, reused = json.loads(profile.read_text())["phases"]["repr"]["calls"], counts["reused_stanzas"]
+            assert 0 < rendered < reused and rendered + reused == counts["targets"]
+
+            # Previous output generated with different arguments is not reused
+            for name, args in [
+                ("full", [f"{lock_path}", "--collapse_cycles"]),
+                ("incremental", [f"{lock_path}", "--collapse_cycles", f"--previous_lock={previous_lock}"]),
+            ]:
+                with io.StringIO() as buffer, contextlib.redirect_stdout(buffer):
+                    main(args + ["--output=all", f"--previous_output={tmpdir}/previous.out", f"--profile={profile}"])
+                    outputs[name] = buffer.getvalue()
+            assert outputs["incremental"] == outputs["full"]
+            assert "reused_stanzas" not in json.loads(profile.read_text())["counts"]
+
+    def test_airflow_shards(self):
+        outputs = {}
+        for shards in [0, 7]:
+            with io.StringIO() as buffer, contextlib.redirect_stdout(buffer):
+                main([self.assets.format("airflow"), json.dumps({"a": "b"}), f"--shards={shards}"])
+                outputs[shards] = buffer.getvalue()
+        sharded = json.loads(outputs[7])
+        assert len(sharded["shards"]) == 7
+
+        def stanzas(build_file):
+            return re.findall(r"^\w+\(\n.*?^\)$", build_file, re.MULTILINE | re.DOTALL)
+
+        # Root package has only aliases of all targets
+        targets = {re.search(r'name = "([^"]+)"', stanza)[1] for stanza in stanzas(outputs[0])}
+        aliases = {
+            re.search(r'name = "([^"]+)"', stanza)[1]: re.search(r'actual = "//(_shard_\d):([^"]+)"', stanza).groups()
+            for stanza in stanzas(sharded["packages"])
+        }
+        assert aliases.keys() == targets and all(name == actual for name, (_, actual) in aliases.items())
+
+        # Shards have targets of root aliases and equal stanzas with local labels
+        sharded_stanzas = []
+        for shard, build_file in sharded["shards"].items():
+            for stanza in stanzas(build_file):
+                assert aliases[re.search(r'name = "([^"]+)"', stanza)[1]][0] == shard
+                for label_shard, name in re.findall(r'"//(_shard_\d):([^"]+)"', stanza):
+                    assert label_shard != shard and aliases.get(name, (label_shard,))[0] == label_shard
+                sharded_stanzas.append(re.sub(r'"//_shard_\d:', '":', stanza))
+        assert sorted(sharded_stanzas) == sorted(stanzas(outputs[0]))
+
+    def test_airflow_stats(self):
+        with io.StringIO() as buffer, contextlib.redirect_stdout(buffer):
+            main([self.assets.format("airflow"), "--output=stats"])
+            stats = json.loads(buffer.getvalue())
+        assert stats["sources"] == {"pypi": stats["packages"]}
+        assert stats["sdist_only"] == ["python-nvd3", "unicodecsv"] and stats["sdist_fallback"] == {}
+        assert ["apache-airflow-providers-common-io", "apache-airflow"] in stats["removed_edges"]
+        assert stats["recorded_bytes"] == 0 and stats["download_bytes"] == {}
+        assert stats["collapsed_edges"] == []
+
+        # Statistics do not modify packages and edges inside collapsed cycles are not removed edges
+        packages = parser.load_locked_packages(Path(self.assets.format("airflow")), Path())
+        expected = [(package.name, dict(package.dependencies)) for package in packages]
+        collapsed = parser.generate_stats(packages, None, None, collapse=True)
+        assert [(package.name, dict(package.dependencies)) for package in packages] == expected
+        assert collapsed["collapsed_edges"] == [
+            ["apache-airflow-core", "apache-airflow-task-sdk"],
+            ["apache-airflow-task-sdk", "apache-airflow-core"],
+        ]
+        assert len(collapsed["removed_edges"]) == len(stats["removed_edges"]) - 1
+
+    def test_libc_versions(self):
+        def targets(lock, package, **platform):
+            platform = {"platform_machine": "x86_64", "platform_tags": ["manylinux_2_17_x86_64"]} | platform
+            with io.StringIO() as buffer, contextlib.redirect_stdout(buffer):
+                main([self.assets.format(lock), json.dumps({"linux": json.dumps(platform)})])
+                build_file = buffer.getvalue()
+            pattern = rf'"@ofiuco//python/platforms:([^"]+-linux-[^"]+)": "@({package}-[^"]+)//:whl"'
+            return dict(re.findall(pattern, build_file))
+
+        airflow = targets("airflow", "cryptography")
+        assert airflow["cp3x-abi3-linux-x86_64-glibc"] == "cryptography-45.0.3-cp311-abi3-manylinux_2_28_x86_64"
+        airflow = targets("airflow", "cryptography", glibc_version="2.35")
+        assert airflow["cp3x-abi3-linux-x86_64-glibc"] == "cryptography-45.0.3-cp311-abi3-manylinux_2_34_x86_64"
+        assert airflow["cp3x-abi3-linux-aarch64-glibc"] == "cryptography-45.0.3-cp311-abi3-manylinux_2_28_aarch64"
+        airflow = targets("airflow", "cryptography", glibc_version="2.17")
+        assert airflow["cp3x-abi3-linux-x86_64-glibc"].endswith(
+            "-cp311-abi3-manylinux_2_17_x86_64.manylinux2014_x86_64"
+        )
+
+        torch = targets("torch", "bcrypt", glibc_version="2.35", musl_version="1.2")
+        assert torch["cp313-cp313t-linux-x86_64-glibc"] == "bcrypt-4.3.0-cp313-cp313t-manylinux_2_34_x86_64"
+        assert torch["cp313-cp313t-linux-aarch64-glibc"] == "bcrypt-4.3.0-cp313-cp313t-manylinux_2_28_aarch64"
+
+        # Wheels for libc versions of platforms are kept by pruning and the oldest version is used for all platforms
+        platforms = {
+            "new": json.dumps({"platform_tags": ["manylinux_2_17_x86_64"], "glibc_version": "2.35"}),
+            "old": json.dumps({"platform_tags": ["manylinux_2_17_x86_64"], "glibc_version": "2.28"}),
+        }
+        assert parser.get_platform_tags(platforms)["new"] == ("manylinux_2_17_x86_64", "manylinux_2_35_x86_64")
+        assert parser.get_libc_versions(platforms) == {("glibc", "x86_64"): (2, 28)}
+
+        # Platforms without libc versions are included with default versions or newer versions of their tags
+        platforms = {
+            "new": json.dumps({"platform_tags": ["manylinux_2_17_x86_64"], "glibc_version": "2.35"}),
+            "default": json.dumps({"platform_machine": "x86_64", "platform_tags": ["manylinux_2_28_x86_64"]}),
+            "musl": json.dumps({"platform_tags": ["musllinux_1_2_x86_64"]}),
+            "arm": json.dumps({"platform_machine": "arm64", "sys_platform": "linux"}),
+            "macos": json.dumps({"platform_machine": "x86_64", "sys_platform": "darwin"}),
+        }
+        assert parser.get_libc_versions(platforms) == {
+            ("glibc", "x86_64"): (2, 31),
+            ("musl", "x86_64"): (1, 2),
+            ("glibc", "aarch64"): (2, 31),
+            ("musl", "aarch64"): (1, 1),
+        }
+        with io.StringIO() as buffer, contextlib.redirect_stdout(buffer):
+            main([self.assets.format("airflow"), json.dumps(platforms)])
+            build_file = buffer.getvalue()
+        assert "cryptography-45.0.3-cp311-abi3-manylinux_2_34_x86_64" not in build_file
+        assert "cryptography-45.0.3-cp311-abi3-manylinux_2_28_x86_64" in build_file
+
+    def test_torch_wheel_tags(self):
+        packages = parser.load_poetry_locked_packages(Path(self.assets.format("torch")), Path())
+        parser.get_wheel_tag.cache_clear()
+        parser.parse_wheel_platforms.cache_clear()
+
+        selects = [package.select for package in packages]
+
+        # Wheel files share few distinct tags which are parsed once
+        info = parser.get_wheel_tag.cache_info()
+        assert info.currsize < (info.hits + info.misses) / 4, info
+        assert selects == [package.select for package in packages]
+
+    def test_torch_share_selects(self):
+        packages = parser.load_poetry_locked_packages(Path(self.assets.format("torch")), Path())
+        groups = parser.ConditionGroups()
+        definitions = groups.collect(packages, None)
+        assert 0 < len(groups.groups) < len(packages)
+
+        # Condition lists of all selects are collected before stanzas are rendered
+        collected = dict(groups.groups)
+        selects = [(package.select_conditions, groups.render_select(package.select_conditions)) for package in packages]
+        assert groups.groups == collected
+
+        # Compact selects are Python expressions which evaluate to the same conditions
+        scope = {"select": lambda conditions: conditions}
+        exec(definitions, scope)
+        for conditions, compact in selects:
+            if len(conditions) > 1:
+                expected = {eval(condition): eval(str(target)) for condition, target in conditions}
+                assert eval("".join(compact), scope) == expected
+            else:
+                assert compact == [target for _, target in conditions]
+
+    def test_package_views(self):
+        package = parser.Package(name="a", version="1.2", files={"a-1.2-py3-none-any.whl": "x", "a-1.2.tar.gz": "y"})
+        assert not hasattr(package, "__dict__")
+        assert package.wheels == {"a-1.2-py3-none-any": "x"} and package.wheels is package.wheels
+        assert package.sdist == {"a-1.2": "y"} and package.semver == (1, 2, 0, 0)
+
+        # Views are reset on assignments
+        package.files = {"a-1.3-py3-none-any.whl": "z"}
+        package.version = "1.3"
+        assert package.wheels == {"a-1.3-py3-none-any": "z"} and package.sdist == {}
+        assert package.semver == (1, 3, 0, 0)
+
     def test_find_unique_name(self):
         assert find_unique_name(["a", "b", "b", "c"], "d") == "d"
         assert find_unique_name(["a", "b", "b", "c"], "b") == "_b"
         assert find_unique_name(["a", "b", "_b", "c"], "_b") == "__b"
 
+    def test_remove_cycles(self):
+        graph = {"a": ["b", "c"], "b": ["c"], "c": ["a", "c"], "d": ["a"]}
+        removed_edges, components = parser.remove_cycles(graph)
+        assert removed_edges == {"c": {"a", "c"}}
+        assert components == [["a", "b", "c"], ["d"]]
+
+    def test_remove_cycles_stress(self):
+        rng = random.Random(42)
+        size = 10000
+        names = [f"p{index:05}" for index in range(size)]
+        graph = {name: set() for name in names}
+        for index, name in enumerate(names):
+            # Long chain through all nodes closed into a cycle and random edges in both directions
+            graph[name].add(names[(index + 1) % size])
+            graph[name].update(rng.choices(names, k=3))
+        graph = {name: sorted(dependencies) for name, dependencies in graph.items()}
+
+        removed_edges, components = parser.remove_cycles(graph)
+
+        # All nodes form one strongly connected component
+        assert [len(component) for component in components] == [size]
+
+        # Remaining graph is acyclic
+        in_degree = dict.fromkeys(graph, 0)
+        remaining = {u: [v for v in vs if v not in removed_edges.get(u, ())] for u, vs in graph.items()}
+        for vs in remaining.values():
+            for v in vs:
+                in_degree[v] += 1
+        queue = [u for u, degree in in_degree.items() if degree == 0]
+        for u in queue:
+            for v in remaining[u]:
+                in_degree[v] -= 1
+                if in_degree[v] == 0:
+                    queue.append(v)
+        assert len(queue) == size
+
+        # Result is deterministic
+        assert parser.remove_cycles(graph)[0] == removed_edges
+
     def test_platform_parsing(self):
         """Test against 'bazel query //python/platforms/...'"""
         tests = [
@@ -177,6 +436,109 @@ class TestPoetryInstallSubcommand(unittest.TestCase):
             actual = parser.get_best_match(wheel_targets, **kwargs)
             assert actual[0] == expected, f"{actual[0]} ≠ {expected} for {test} at {index}"
 
+    def test_best_package_mixed(self):
+        def wheel_targets(*tags):
+            return [
+                (tag, dict(zip(("python_tag", "abi_tag", "platform"), tag.split("-"), strict=True)), tag)
+                for tag in tags
+            ]
+
+        libc = {"glibc": (2, 31), "musl": (1, 1)}
+        abi3 = wheel_targets("cp37-abi3-manylinux_2_28_x86_64", "cp311-abi3-manylinux_2_28_x86_64")
+        assert parser.get_best_match(abi3, **libc)[0] == "cp37-abi3-manylinux_2_28_x86_64"
+        assert parser.get_best_match(abi3, **libc, python_minor=10)[0] == "cp37-abi3-manylinux_2_28_x86_64"
+        assert parser.get_best_match(abi3, **libc, python_minor=13)[0] == "cp311-abi3-manylinux_2_28_x86_64"
+        assert parser.get_best_match(abi3[1:], **libc, python_minor=10) is None
+
+        # Incompatible libc versions of newer builds and mixed libc and legacy Linux tags
+        mixed = wheel_targets("cp37-abi3-manylinux_2_17_x86_64", "cp311-abi3-manylinux_2_34_x86_64")
+        assert parser.get_best_match(mixed, **libc, python_minor=13)[0] == "cp37-abi3-manylinux_2_17_x86_64"
+        legacy = wheel_targets("cp312-cp312-linux_x86_64", "cp312-cp312-manylinux_2_17_x86_64")
+        assert parser.get_best_match(legacy, **libc)[0] == "cp312-cp312-manylinux_2_17_x86_64"
+        legacy = wheel_targets("cp312-cp312-linux_x86_64", "cp312-cp312-manylinux_2_34_x86_64")
+        assert parser.get_best_match(legacy, **libc)[0] == "cp312-cp312-linux_x86_64"
+
+    def test_stable_abi_conditions(self):
+        package = parser.Package(
+            name="cryptography",
+            version="45.0.7",
+            files={
+                f"cryptography-45.0.7-{tag}.whl": "sha256"
+                for tag in [
+                    "cp37-abi3-manylinux_2_28_x86_64",
+                    "cp312-abi3-manylinux_2_28_x86_64",
+                    "cp313-cp313-manylinux_2_28_x86_64",
+                    "cp314-cp314t-manylinux_2_28_x86_64",
+                    "cp37-abi3-macosx_11_0_arm64",
+                    "cp312-abi3-macosx_11_0_arm64",
+                    "cp313-cp313-macosx_11_0_x86_64",
+                ]
+            },
+        )
+        conditions = {condition.split(":")[-1].strip('"'): target for condition, target in package.select_conditions}
+        assert "cp37-abi3" in conditions["cp3x-abi3-linux-x86_64-glibc"]
+        assert "cp312-abi3" in conditions["cp312-abi3-linux-x86_64-glibc"]
+        assert conditions["cp312-abi3-linux-x86_64-glibc"] == conditions["cp316-abi3-linux-x86_64-glibc"]
+
+        # Conditions which select the generic target or are ambiguous with version-specific wheels are skipped
+        assert "cp311-abi3-linux-x86_64-glibc" not in conditions and "cp313-abi3-linux-x86_64-glibc" not in conditions
+        assert not any(condition.startswith(("cp34-", "cp310-")) for condition in conditions)
+
+        # Version-specific wheels hide stable ABI conditions only for the same macOS architecture
+        assert "cp312-abi3" in conditions["cp313-abi3-macosx_11_0_arm64"]
+        assert "cp313-abi3-macosx_11_0_x86_64" not in conditions
+
+        # Free-threaded wheels are selected by own conditions and do not hide stable ABI conditions
+        assert "cp314-cp314t" in conditions["cp314-cp314t-linux-x86_64-glibc"]
+        assert "cp312-abi3" in conditions["cp314-abi3-linux-x86_64-glibc"]
+        assert parser.is_freethreaded_abi("cp314", "cp314t") and not parser.is_freethreaded_abi("cp314", "abi3")
+
+        # The generic condition selects the newest stable ABI build for the oldest supported Python version
+        package.files = {name: sha256 for name, sha256 in package.files.items() if "cp312-abi3" not in name}
+        package.files |= {"cryptography-45.0.7-cp311-abi3-manylinux_2_28_x86_64.whl": "sha256"}
+        conditions = {condition.split(":")[-1].strip('"'): target for condition, target in package.select_conditions}
+        assert "cp311-abi3" in conditions["cp3x-abi3-linux-x86_64-glibc"]
+        assert not any("-abi3-linux" in condition and not condition.startswith("cp3x") for condition in conditions)
+
+    def test_cpu_level_variants(self):
+        package = parser.Package(
+            name="numpy",
+            version="1.26.4",
+            files={
+                f"numpy-1.26.4{tag}-cp312-cp312-{platform}.whl": "sha256"
+                for tag in ["", "-avx2", "-x86_64_v4"]
+                for platform in ["manylinux_2_28_x86_64", "manylinux_2_28_aarch64"]
+                if not tag or "x86_64" in platform
+            },
+        )
+        assert parser.get_wheel_cpu_level("numpy-1.26.4-avx2-cp312-cp312-manylinux_2_28_x86_64.whl") == 3
+        assert parser.get_wheel_cpu_level("numpy-1.26.4-cp312-cp312-manylinux_2_28_x86_64.whl") is None
+        assert parser.get_wheel_cpu_level("torch-2.7.0-cu118-cp312-cp312-manylinux_2_28_x86_64.whl") is None
+
+        # Baseline wheels are selected by conditions and variants up to the highest platform CPU level
+        conditions = {condition.split(":")[-1].strip('"'): target for condition, target in package.select_conditions}
+        assert conditions["cp312-cp312-linux-x86_64-glibc"] == '"@numpy-1.26.4-cp312-cp312-manylinux_2_28_x86_64//:whl"'
+        assert not package.get_variant_conditions()
+        variants = package.get_variant_conditions(cpu_levels=parser.get_cpu_levels({"x": '{"cpu_level": "x86_64_v3"}'}))
+        assert variants == {
+            '"@ofiuco//python/platforms:cp312-cp312-linux-x86_64-glibc"': {
+                '"@numpy-1.26.4-avx2-cp312-cp312-manylinux_2_28_x86_64//:whl"': "x86_64_v3"
+            }
+        }
+        assert "variants = select({" in package.repr({"x": '{"cpu_level": "x86_64_v4"}'}, False, False)
+        assert "variants" not in package.repr({"x": "{}"}, False, False)
+
+        # Packages with only variant wheels fall back to the source distribution at hosts without CPU levels
+        package.files = {name: sha256 for name, sha256 in package.files.items() if parser.get_wheel_cpu_level(name)}
+        assert package.select_conditions == [('"//conditions:default"', None)]
+        package.files |= {"numpy-1.26.4.tar.gz": "sha256"}
+        assert package.select_conditions == [('"//conditions:default"', '"@numpy-1.26.4//:sdist"')]
+        variants = package.get_variant_conditions(cpu_levels={"x86_64": 4})
+        assert set(variants['"@ofiuco//python/platforms:cp312-cp312-linux-x86_64-glibc"'].values()) == {
+            "x86_64_v3",
+            "x86_64_v4",
+        }
+
     def test_back_compatible_targets(self):
         wheel_target = "x"
         tests = [
@@ -246,6 +608,410 @@ class TestUvInstallSubcommand(unittest.TestCase):
         ), repositories
         assert r"d2b3b4bda1a025b10fe0269369475f420177f2cb06e0f9d32c95b4873c9f80b8" in repositories, repositories
 
+    def test_sphinx_all(self):
+        args = [self.sphinx_lock, json.dumps({"a": "b"}), f"--project_file={self.sphinx_lock}"]
+        outputs = {}
+        for output in ["packages", "files", "all"]:
+            with io.StringIO() as buffer, contextlib.redirect_stdout(buffer):
+                main(args + [f"--output={output}"])
+                outputs[output] = buffer.getvalue()
+
+        combined = json.loads(outputs["all"])
+        assert combined["packages"] == outputs["packages"]
+        assert combined["files"] == json.loads(outputs["files"])
+
+    def test_sphinx_single_parse(self):
+        # The module extension runs with output=all and the repository rule reads packages from its cache entry
+        args = [self.sphinx_lock, json.dumps({"a": "b"}), f"--project_file={self.sphinx_lock}"]
+        for shards in [[], ["--shards=2"]]:
+            outputs = []
+            with (
+                tempfile.TemporaryDirectory(dir=self.tmpdir) as cache_dir,
+                unittest.mock.patch.object(
+                    parser, "load_locked_packages", wraps=parser.load_locked_packages
+                ) as load_locked_packages,
+            ):
+                for output in [["--output=all"], []]:
+                    with io.StringIO() as buffer, contextlib.redirect_stdout(buffer):
+                        main(args + shards + output + [f"--cache_dir={cache_dir}"])
+                        outputs.append(buffer.getvalue())
+                assert load_locked_packages.call_count == 1
+
+            with io.StringIO() as buffer, contextlib.redirect_stdout(buffer):
+                main(args + shards)
+                expected = buffer.getvalue()
+            combined = json.loads(outputs[0])
+            if shards:
+                packages = {key: combined[key] for key in ("packages", "shards")}
+                assert json.loads(outputs[1]) == json.loads(expected) == packages
+            else:
+                assert outputs[1] == expected == combined["packages"]
+
+    def test_sphinx_cache(self):
+        with tempfile.TemporaryDirectory(dir=self.tmpdir) as cache_dir:
+            args = [self.sphinx_lock, "--output=all", f"--cache_dir={cache_dir}"]
+            with io.StringIO() as buffer, contextlib.redirect_stdout(buffer):
+                main(args)
+                expected = buffer.getvalue()
+
+            # Cache hit must not load the lock file
+            with (
+                unittest.mock.patch("tomllib.load", side_effect=AssertionError("lock file is loaded")),
+                io.StringIO() as buffer,
+                contextlib.redirect_stdout(buffer),
+            ):
+                main(args)
+                assert buffer.getvalue() == expected
+
+            # Different arguments must not hit the cache
+            with io.StringIO() as buffer, contextlib.redirect_stdout(buffer):
+                main(args + ["--enable_rust"])
+                assert buffer.getvalue() != expected
+
+            assert len(entries := list(Path(cache_dir).glob("*/*"))) == 2
+
+            # Empty and unparsable entries are misses and evicted entries are not recreated on reads
+            key = entries[0].name
+            for content in ["", '{\n  "files": [']:
+                entries[0].write_text(content)
+                assert parser.read_cache(Path(cache_dir), key, json_output=True) is None
+            entries[0].unlink()
+            assert parser.read_cache(Path(cache_dir), key) is None and not entries[0].exists()
+            for run_args in [args, args + ["--enable_rust"]]:
+                with io.StringIO() as buffer, contextlib.redirect_stdout(buffer):
+                    main(run_args)
+            assert len(entries := list(Path(cache_dir).glob("*/*"))) == 2
+
+            max_size = max(entry.stat().st_size for entry in entries)
+            parser.evict_cache(Path(cache_dir), max_size=max_size, max_age=3600)
+            assert len(list(Path(cache_dir).glob("*/*"))) == 1
+            parser.evict_cache(Path(cache_dir), max_size=max_size, max_age=-1)
+            assert not list(Path(cache_dir).glob("*/*"))
+
+    def test_sphinx_profile(self):
+        with tempfile.TemporaryDirectory(dir=self.tmpdir) as tmpdir:
+            profile_path = Path(tmpdir) / "profiles" / "sphinx.json"
+            args = [self.sphinx_lock, "--output=all", f"--cache_dir={tmpdir}", f"--profile={profile_path}"]
+            with io.StringIO() as buffer, contextlib.redirect_stdout(buffer):
+                main(args + ["--profile_functions=5"])
+            profile = json.loads(profile_path.read_text())
+            assert profile["lock"] == self.sphinx_lock and profile["output"] == "all"
+            assert {"cache", "load", "files", "prepare", "repr", "write"} == profile["phases"].keys()
+            assert profile["phases"]["repr"]["calls"] == profile["counts"]["targets"]
+            assert profile["counts"]["packages"] < profile["counts"]["targets"] < profile["counts"]["repositories"]
+            assert profile["counts"]["cache_hits"] == 0
+            assert all(timing["wall"] >= 0 and timing["cpu"] >= 0 for timing in profile["phases"].values())
+            assert len(profile["functions"]) == 5
+            assert "main" in profile["functions"][0]["function"]
+
+            # Cache hits are profiled without loading the lock file
+            with io.StringIO() as buffer, contextlib.redirect_stdout(buffer):
+                main(args)
+            profile = json.loads(profile_path.read_text())
+            assert profile["phases"].keys() == {"cache"} and profile["counts"] == {"cache_hits": 1}
+            assert "functions" not in profile
+
+    def test_sphinx_incremental(self):
+        lock = Path(self.sphinx_lock).read_text()
+        babel = "babel-2.17.0-py3-none-any.whl"
+        babel_hash = "sha256:4d0b53093fdfb4b21c92b5213dba5a1b23885afa8383709427046b21c366e5f2"
+        changed = lock.replace(f'{babel}", hash = "{babel_hash}"', f'{babel}", hash = "sha256:{"0" * 64}"')
+        changed = re.sub(r'\[\[package\]\]\nname = "xattr".*?(?=\[\[package\]\])', "", changed, flags=re.DOTALL)
+        assert changed.count("[[package]]") == lock.count("[[package]]") - 1 and "0" * 64 in changed
+
+        with tempfile.TemporaryDirectory(dir=self.tmpdir) as tmpdir:
+            previous_lock, lock_path = Path(tmpdir, "previous", "uv.lock"), Path(tmpdir, "uv.lock")
+            previous_lock.parent.mkdir()
+            previous_lock.write_text(lock)
+            lock_path.write_text(changed)
+            args = [f"--project_file={self.sphinx_lock}", "--output=all", f"--profile={tmpdir}/profile.json"]
+
+            outputs = {}
+            for name, lock_args in [
+                ("previous", [f"{previous_lock}"]),
+                ("full", [f"{lock_path}"]),
+                ("incremental", [f"{lock_path}", f"--previous_lock={previous_lock}"]),
+            ]:
+                with io.StringIO() as buffer, contextlib.redirect_stdout(buffer):
+                    main(lock_args + args + [f"--previous_output={tmpdir}/previous.out"])
+                    outputs[name] = buffer.getvalue()
+                Path(tmpdir, f"{name}.out").write_text(outputs[name])
+
+            assert outputs["incremental"] == outputs["full"] != outputs["previous"]
+            profile = json.loads(Path(tmpdir, "profile.json").read_text())
+            assert profile["counts"]["reused_files"] == profile["counts"]["packages"] - 1
+            assert profile["phases"]["repr"]["calls"] < profile["counts"]["reused_stanzas"]
+
+            # Previous output generated with other prune flags is regenerated as the full output
+            platforms = json.dumps(benchmark.PLATFORMS)
+            for name, lock_args in [
+                ("previous", [f"{previous_lock}", platforms, "--prune_files"]),
+                ("full", [f"{lock_path}", platforms]),
+                ("incremental", [f"{lock_path}", platforms, f"--previous_lock={previous_lock}"]),
+            ]:
+                with io.StringIO() as buffer, contextlib.redirect_stdout(buffer):
+                    main(lock_args + args + [f"--previous_output={tmpdir}/previous.out"])
+                    outputs[name] = buffer.getvalue()
+                Path(tmpdir, f"{name}.out").write_text(outputs[name])
+
+            assert outputs["incremental"] == outputs["full"]
+            assert len(json.loads(outputs["previous"])["files"]) < len(json.loads(outputs["full"])["files"])
+            counts = json.loads(Path(tmpdir, "profile.json").read_text())["counts"]
+            assert "reused_files" not in counts and "reused_stanzas" not in counts
+
+    def test_sphinx_shards(self):
+        args = [self.sphinx_lock, "--output=all", f"--project_file={self.sphinx_lock}"]
+        with io.StringIO() as buffer, contextlib.redirect_stdout(buffer):
+            main(args)
+            expected = json.loads(buffer.getvalue())
+        with io.StringIO() as buffer, contextlib.redirect_stdout(buffer):
+            main(args + ["--shards=1"])
+            sharded = json.loads(buffer.getvalue())
+        assert sharded.keys() == {"fingerprint", "files", "packages", "shards"}
+        assert sharded["files"] == expected["files"]
+        assert sharded["shards"] == {"_shard_0": expected["packages"]}
+        shard = parser.get_shard("torch", 16)
+        assert parser.get_shard("torch@2.7.0", 16) == parser.get_shard("torch[cuda]", 16) == shard
+
+    def test_sphinx_prune_files(self):
+        platforms = json.dumps(benchmark.PLATFORMS)
+        outputs = {}
+        for args in [[], ["--prune_files"]]:
+            with io.StringIO() as buffer, contextlib.redirect_stdout(buffer), contextlib.redirect_stderr(io.StringIO()):
+                main([self.sphinx_lock, platforms, "--output=all", f"--project_file={self.sphinx_lock}", *args])
+                outputs[bool(args)] = json.loads(buffer.getvalue())
+
+        files, pruned = ({file["name"] for file in outputs[key]["files"]} for key in (False, True))
+        referenced = set(re.findall(r'"@([^/"]+)//:(?:whl|sdist|pkg)"', outputs[True]["packages"]))
+        assert referenced <= pruned < files and len(pruned) < len(files) / 2
+        assert "babel-2.17.0-py3-none-any" in pruned and "babel-2.17.0" not in pruned
+        assert "dulwich-0.22.8-cp312-cp312-win_amd64" in pruned and "dulwich-0.22.8-cp312-cp312-win32" not in pruned
+
+        # Dropped wheels can not be selected at any platform
+        tags = tuple(tag for value in benchmark.PLATFORMS.values() for tag in json.loads(value)["platform_tags"])
+        for name in files - pruned:
+            if tag := parser.parse_wheel_tag(name):
+                assert not parser.is_compatible_platform(tag.platform, tags) or tag.python_tag.startswith("pp")
+
+    def test_universal2_prune_files(self):
+        lock = """version = 1
+requires-python = ">=3.12"
+
+[[package]]
+name = "fat"
+version = "1.0"
+source = { registry = "https://pypi.org/simple" }
+sdist = { url = "https://example.com/fat-1.0.tar.gz", hash = "sha256:00" }
+wheels = [
+    { url = "https://example.com/fat-1.0-cp312-cp312-macosx_10_13_universal2.whl", hash = "sha256:01" },
+    { url = "https://example.com/fat-1.0-cp312-cp312-win_amd64.whl", hash = "sha256:02" },
+]
+"""
+        platforms = json.dumps({"aarch64-apple-darwin": benchmark.PLATFORMS["aarch64-apple-darwin"]})
+        with tempfile.TemporaryDirectory(dir=self.tmpdir) as tmpdir:
+            Path(tmpdir, "uv.lock").write_text(lock)
+            with io.StringIO() as buffer, contextlib.redirect_stdout(buffer), contextlib.redirect_stderr(io.StringIO()):
+                main([f"{tmpdir}/uv.lock", platforms, "--output=all", "--prune_files"])
+                output = json.loads(buffer.getvalue())
+
+        # Universal wheels are kept for arm64 and x86_64 platforms
+        files = {file["name"] for file in output["files"]}
+        assert files == {"fat-1.0-cp312-cp312-macosx_10_13_universal2", "fat-1.0"}, files
+        assert "@fat-1.0-cp312-cp312-macosx_10_13_universal2//:whl" in output["packages"]
+
+    def test_sphinx_prune_unreachable(self):
+        platforms = json.dumps({name: value for name, value in benchmark.PLATFORMS.items() if "linux" in name})
+        project_file = Path(self.sphinx_lock).with_name("pyproject.toml")
+        outputs = {}
+        for args in [[], ["--prune_unreachable"]]:
+            with io.StringIO() as buffer, contextlib.redirect_stdout(buffer), contextlib.redirect_stderr(io.StringIO()):
+                main([self.sphinx_lock, platforms, "--output=all", f"--project_file={project_file}", *args])
+                outputs[bool(args)] = json.loads(buffer.getvalue())
+
+        def targets(build_file):
+            return dict(re.findall(r'^\w+\(\n  name = "([^"]+)",\n(.*?)^\)$', build_file, re.MULTILINE | re.DOTALL))
+
+        full, pruned = targets(outputs[False]["packages"]), targets(outputs[True]["packages"])
+        stubs = {name for name, attrs in pruned.items() if "Not used at configured platforms" in attrs}
+        assert full.keys() == pruned.keys() and stubs == {"pywin32-ctypes", "xattr"}
+        assert all("package = " not in pruned[name] and "deps = " not in pruned[name] for name in stubs)
+        assert {file["name"] for file in outputs[True]["files"]} == {
+            file["name"] for file in outputs[False]["files"] if not file["name"].startswith(("xattr", "pywin32"))
+        }
+
+    def test_sphinx_stats(self):
+        platforms = {
+            "linux": json.dumps({"platform_tags": ["manylinux_2_17_x86_64"]}),
+            "linux_2_28": json.dumps({"platform_tags": ["manylinux_2_28_x86_64"]}),
+            "macos": json.dumps({"platform_tags": ["macosx_14_0_arm64"]}),
+            "windows": json.dumps({"platform_tags": ["win_amd64"]}),
+        }
+        with io.StringIO() as buffer, contextlib.redirect_stdout(buffer):
+            main([self.sphinx_lock, json.dumps(platforms), "--output=stats"])
+            stats = json.loads(buffer.getvalue())
+
+        with open(self.sphinx_lock, "rb") as lock_file:
+            lock = parser.tomllib.load(lock_file)
+        files = [file for package in lock["package"] for file in package.get("wheels", []) + [package.get("sdist", {})]]
+        assert stats["packages"] == len(lock["package"])
+        assert stats["sources"] == {"directory": 1, "git": 1, "legacy": 87}
+        assert stats["files"] == sum(1 for file in files if file)
+        assert stats["recorded_bytes"] == sum(file.get("size", 0) for file in files)
+        assert stats["select_conditions"]["max"] > stats["select_conditions"]["median"] == 1
+        assert stats["sdist_fallback"]["linux"] == ["rapidfuzz", "xattr"]
+        assert stats["sdist_fallback"]["linux_2_28"] == ["xattr"]
+        assert "cryptography" in stats["sdist_fallback"]["macos"] and "cffi" in stats["sdist_fallback"]["windows"]
+        assert 0 < stats["download_bytes"]["macos"] < stats["recorded_bytes"]
+        assert stats["removed_edges"] == []
+
+    def test_markers(self):
+        linux = {"sys_platform": "linux", "platform_machine": "x86_64", "os_name": "posix"}
+        for marker, expected in [
+            ("sys_platform == 'linux'", True),
+            ('sys_platform == "win32"', False),
+            ("'linux' in sys_platform and os_name != 'nt'", True),
+            ("platform_system == 'Windows'", None),
+            ("platform_system == 'Windows' and sys_platform == 'win32'", False),
+            ("platform_system == 'Windows' or sys_platform == 'linux'", True),
+            ("(python_version < '3.11' or sys_platform == 'win32') and os_name == 'posix'", None),
+            ("extra == 'socks'", None),
+            ("sys_platform ==", None),
+        ]:
+            assert parser.evaluate_marker(parser.parse_marker(marker), linux) is expected, marker
+
+        environment = {"python_version": "3.12", "python_full_version": "3.12.4"}
+        for marker, expected in [
+            ('python_version >= "3.9"', True),
+            ('python_version < "3.10"', False),
+            ('python_full_version < "3.12.5"', True),
+            ('python_version == "3.*"', True),
+            ('python_full_version ~= "3.12.0"', True),
+            ('python_version ~= "3.10"', True),
+            ('python_version != "3.12"', False),
+        ]:
+            assert parser.evaluate_marker(parser.parse_marker(marker), environment) is expected, marker
+
+    def test_resolve_markers(self):
+        platforms = {
+            "linux": json.dumps({"sys_platform": "linux", "platform_tags": ["manylinux_2_28_x86_64"]}),
+            "windows": json.dumps({"sys_platform": "win32", "python_version": "3.10"}),
+        }
+        markers = {
+            "colorama": 'sys_platform == "win32"',
+            "tomli": 'python_version < "3.12"',
+            "cffi": 'sys_platform == "linux" and extra == "ffi"',
+            "poetry": {"main": 'sys_platform == "linux"'},
+        }
+        assert parser.resolve_markers(markers, platforms) == {
+            "linux": {"colorama": False, "tomli": {"3.11": True, "3.12": False, "3.13": False, "3.14": False}},
+            "windows": {"colorama": True, "tomli": True, "cffi": False},
+        }
+        assert parser.resolve_markers(markers, None) == {}
+
+    def test_compatible_platform(self):
+        assert parser.is_compatible_platform("any", ())
+        assert parser.is_compatible_platform("manylinux_2_17_x86_64.manylinux2014_x86_64", ("manylinux_2_28_x86_64",))
+        assert not parser.is_compatible_platform("manylinux_2_28_x86_64", ("manylinux_2_17_x86_64",))
+        assert not parser.is_compatible_platform("manylinux_2_17_aarch64", ("manylinux_2_28_x86_64",))
+        assert not parser.is_compatible_platform("musllinux_1_1_x86_64", ("manylinux_2_28_x86_64",))
+        assert parser.is_compatible_platform("macosx_11_0_arm64", ("macosx_14_0_arm64",))
+        assert not parser.is_compatible_platform("macosx_11_0_x86_64", ("macosx_14_0_arm64",))
+        assert parser.is_compatible_platform("macosx_10_9_universal2", ("macosx_14_0_arm64",))
+        assert parser.is_compatible_platform("macosx_10_9_intel", ("macosx_10_15_x86_64",))
+        assert not parser.is_compatible_platform("macosx_10_9_intel", ("macosx_14_0_arm64",))
+        assert not parser.is_compatible_platform("macosx_14_0_universal2", ("macosx_11_0_arm64",))
+        assert parser.is_compatible_platform("win_amd64", ("win32", "win_amd64"))
+
+
+class TestStreaming(unittest.TestCase):
+    def test_peak_memory(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            lock = Path(tmpdir) / "poetry.lock"
+            benchmark.write_poetry_lock(lock, benchmark.Synthetic(10000))
+            packages = parser.load_poetry_locked_packages(lock, Path())
+
+        # Derived views are cached in packages on the first access
+        for package in packages:
+            assert package.wheels and package.sdist
+
+        for share_selects in [False, True]:
+            tracemalloc.start()
+            try:
+                with open(os.devnull, "w") as output:
+                    stanzas = parser.generate_packages(
+                        packages, benchmark.PLATFORMS, True, False, None, share_selects=share_selects
+                    )
+                    size = output.write(next(stanzas))
+                    _, prepare_peak = tracemalloc.get_traced_memory()
+
+                    # Memory of writing stanzas after the packages are prepared
+                    start, _ = tracemalloc.get_traced_memory()
+                    tracemalloc.reset_peak()
+                    for stanza in stanzas:
+                        size += output.write(stanza)
+                    _, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+
+            # Stanzas are written incrementally, so the output is never held in memory as a whole
+            # and the writing peak is bounded by the largest stanza of the synthetic :all target
+            assert peak - start < size / 2, (share_selects, peak - start, size)
+            assert prepare_peak < size, (share_selects, prepare_peak, size)
+
+
+class TestBenchmark(unittest.TestCase):
+    def test_synthetic_locks(self):
+        synthetic = benchmark.Synthetic(50, cycles=0.5)
+        with tempfile.TemporaryDirectory() as tmpdir, benchmark.serve_index(synthetic) as index_url:
+            poetry_lock, uv_lock = Path(tmpdir) / "poetry.lock", Path(tmpdir) / "uv.lock"
+            benchmark.write_poetry_lock(poetry_lock, synthetic, index_url)
+            benchmark.write_uv_lock(uv_lock, synthetic, index_url)
+
+            poetry_packages = parser.load_poetry_locked_packages(poetry_lock, Path())
+            uv_packages = parser.load_uv_locked_packages(uv_lock, Path())
+            assert [p.files for p in poetry_packages] == [p.files for p in uv_packages]
+            assert [p.dependencies.keys() for p in poetry_packages] == [p.dependencies.keys() for p in uv_packages]
+
+            # Files of Poetry packages are fetched from the local index
+            assert parser.generate_files(poetry_packages) == parser.generate_files(uv_packages)
+
+            result = benchmark.run_scenario(poetry_lock)
+            assert result.keys() >= {"toml", "from_lock", "select", "remove_cycles", "files", "repr", "peak_memory"}
+
+    def test_compare(self):
+        baseline = {"a": {"toml": 0.1, "repr": 0.001, "peak_memory": 1000}}
+        results = {"a": {"toml": 0.2, "repr": 0.005, "peak_memory": 1300}, "b": {"toml": 1.0}}
+        regressions = benchmark.compare(results, baseline, tolerance=1.5, memory_tolerance=1.2, min_delta=0.01)
+        assert len(regressions) == 2 and regressions[0].startswith("a toml") and "peak_memory" in regressions[1]
+
+        # Timings are relative to the calibration workload and sizes are kept
+        results = benchmark.relative({"a": {"toml": 0.2, "output_size": 100, "peak_memory": 1300}}, calibration=0.1)
+        assert results == {"a": {"toml": 2.0, "output_size": 100, "peak_memory": 1300}}
+        regressions = benchmark.compare(results, {"a": {"output_size": 50}}, 1.5, 1.2, min_delta=0.1)
+        assert regressions == ["a output_size: 100 > 50"] and benchmark.calibrate(repeats=1) > 0
+
+
+class TestStartup(unittest.TestCase):
+    def test_import_time(self):
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+        command = [sys.executable, "-X", "importtime", "-c", "import python.private.lock_parser"]
+        result = subprocess.run(command, env=env, capture_output=True, text=True, check=True)
+
+        # Each line is "import time: self [us] | cumulative | imported package"
+        imports = {}
+        for line in result.stderr.splitlines()[1:]:
+            _, cumulative, name = line.split("|")
+            imports[name.strip()] = int(cumulative)
+
+        assert "python.private.lock_parser" in imports
+        assert not {"asyncio", "gzip", "html.parser", "urllib.request"} & imports.keys(), imports.keys()
+
+    def test_rust_packages(self):
+        rust_packages = parser.get_rust_packages()
+        assert isinstance(rust_packages, frozenset)
+        assert "pydantic-core" in rust_packages and "sphinx" not in rust_packages
+        assert parser.get_rust_packages() is rust_packages
+
 
 class TestLegacyIndexParsers(unittest.TestCase):
     expected = {
@@ -253,32 +1019,207 @@ class TestLegacyIndexParsers(unittest.TestCase):
         "872f880de3fc3a5bdc88a11b39c9710c3497a547cfa9320bc3c5e62fbf272e79": "https://files.pythonhosted.org/packages/a8/a4/20da314d277121d6534b3a980b29035dcd51e6744bd79075a6ce8fa4eb8d/pytest-8.4.2-py3-none-any.whl#sha256=872f880de3fc3a5bdc88a11b39c9710c3497a547cfa9320bc3c5e62fbf272e79",
     }
 
-    @unittest.mock.patch("urllib.request.urlopen")
-    def test_json(self, mock_urlopen):
+    @staticmethod
+    def get_simple_index(content_type, body):
+        headers = email.message.Message()
+        headers["Content-Type"] = content_type
+        response = parser.IndexResponse(200, "https://pypi.org/simple/pytest/", headers, body)
+        with (
+            unittest.mock.patch.object(parser.IndexClient, "request", return_value=response),
+            parser.IndexClient() as client,
+        ):
+            return asyncio.run(parser.get_simple_index("pytest", "https://pypi.org/simple", client))
+
+    def test_json(self):
         """curl -s --header 'Accept: application/vnd.pypi.simple.v1+json,text/html' https://pypi.org/simple/pytest"""
-        response = unittest.mock.MagicMock()
-        response.getcode.return_value = 200
-        response.headers.get_content_type.return_value = parser.PYPI_SIMPLE_MIME_TYPE
-        response.read.return_value = Path("python/private/assets/pytest.json").read_bytes()
-        response.__enter__.return_value = response
-        mock_urlopen.return_value = response
-
-        index = asyncio.run(parser.get_simple_index("pytest", "https://pypi.org/simple/pytest"))
+        body = Path("python/private/assets/pytest.json").read_bytes()
+        index = self.get_simple_index(parser.PYPI_SIMPLE_MIME_TYPE, body)
         assert set(self.expected.items()) & set(index.items())
 
-    @unittest.mock.patch("urllib.request.urlopen")
-    def test_html(self, mock_urlopen):
+    def test_html(self):
         """curl -s --header 'Accept: text/html' https://pypi.org/simple/pytest"""
-        response = unittest.mock.MagicMock()
-        response.geturl.return_value = ""
-        response.getcode.return_value = 200
-        response.read.return_value = Path("python/private/assets/pytest.html").read_bytes()
-        response.__enter__.return_value = response
-        mock_urlopen.return_value = response
-
-        index = asyncio.run(parser.get_simple_index("pytest", "https://pypi.org/simple/pytest"))
+        body = Path("python/private/assets/pytest.html").read_bytes()
+        index = self.get_simple_index("text/html", body)
         assert set(self.expected.items()) & set(index.items())
 
 
+class TestSimpleIndexParsers(unittest.TestCase):
+    """Parsers of large project pages against the reference html.parser and json.loads implementations."""
+
+    @staticmethod
+    def measure(function, *args):
+        tracemalloc.start()
+        try:
+            result = function(*args)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        return result, peak
+
+    def test_pages(self):
+        base_url = "https://example.com/simple/pytest/"
+        for scenario, content_type, data, reference in benchmark.simple_index_pages():
+            expected, reference_peak = self.measure(reference, data, base_url)
+            index, peak = self.measure(benchmark.parse_simple_index, data, base_url, content_type)
+            assert index == expected, scenario
+            assert peak < reference_peak, (scenario, peak, reference_peak)
+
+        # Pages without files
+        assert benchmark.parse_simple_index(b'{"name": "a", "files": [ ]}', "", parser.PYPI_SIMPLE_MIME_TYPE) == {}
+        assert benchmark.parse_simple_index(b'{"name": "a"}', "", parser.PYPI_SIMPLE_MIME_TYPE) == {}
+
+    def test_benchmark(self):
+        results = benchmark.run_index_parsers(memory=False)
+        assert results.keys() == {"simple_index/html", "simple_index/json"}
+        assert all(values.keys() == {"reference", "parse", "size"} for values in results.values())
+
+
+class TestIndexClient(unittest.TestCase):
+    """Index client tests with a local HTTP server as a simple index."""
+
+    def setUp(self):
+        self.lock = threading.Lock()
+        self.in_flight = self.max_in_flight = self.connections = 0
+        self.statuses = []
+        self.encodings = set()
+        test = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                with test.lock:
+                    test.connections += 1
+
+            def do_GET(self):
+                with test.lock:
+                    test.in_flight += 1
+                    test.max_in_flight = max(test.max_in_flight, test.in_flight)
+                try:
+                    name = self.path.strip("/").split("/")[-1]
+                    if name != name.lower():
+                        self.send_response(301)
+                        self.send_header("Location", self.path.lower())
+                        self.send_header("Content-Length", "0")
+                        self.end_headers()
+                        return
+
+                    time.sleep(1.0 if name == "slow" else 0.05)
+                    sha256 = hashlib.sha256(name.encode()).hexdigest()
+                    etag = f'"{sha256[:16]}"'
+                    if self.headers.get("If-None-Match") == etag:
+                        test.statuses.append(304)
+                        self.send_response(304)
+                        self.send_header("Content-Length", "0")
+                        self.end_headers()
+                        return
+
+                    files = [{"url": f"{name}-1.0.tar.gz", "hashes": {"sha256": sha256}}]
+                    body = json.dumps({"files": files}).encode()
+                    test.statuses.append(200)
+                    self.send_response(200)
+                    self.send_header("ETag", etag)
+                    self.send_header("Content-Type", parser.PYPI_SIMPLE_MIME_TYPE)
+                    if "gzip" in self.headers.get("Accept-Encoding", ""):
+                        body = gzip.compress(body)
+                        test.encodings.add("gzip")
+                        self.send_header("Content-Encoding", "gzip")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                finally:
+                    with test.lock:
+                        test.in_flight -= 1
+
+            def log_message(self, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.index_url = f"http://127.0.0.1:{self.server.server_address[1]}/simple"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        # Requests to the local server must not go through proxies
+        environ = {k: v for k, v in os.environ.items() if not k.lower().endswith("_proxy")}
+        patcher = unittest.mock.patch.dict(os.environ, environ, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def get_simple_indexes(self, names, required=frozenset(), **kwargs):
+        async def _inner(client):
+            indexes = (parser.get_simple_index(name, self.index_url, client, required) for name in names)
+            return await asyncio.gather(*indexes)
+
+        with parser.IndexClient(**kwargs) as client:
+            return asyncio.run(_inner(client))
+
+    def test_concurrency(self):
+        names = [f"package{i}" for i in range(32)]
+        indexes = self.get_simple_indexes(names, max_in_flight=4)
+
+        for name, index in zip(names, indexes, strict=True):
+            assert index == {hashlib.sha256(name.encode()).hexdigest(): f"{name}-1.0.tar.gz"}
+
+        # Requests are concurrent, capped and reuse keep-alive connections
+        assert 1 < self.max_in_flight <= 4, self.max_in_flight
+        assert self.connections <= 4, self.connections
+        assert self.encodings == {"gzip"}, self.encodings
+
+    def test_redirect(self):
+        (index,) = self.get_simple_indexes(["Package"])
+        assert index == {hashlib.sha256(b"package").hexdigest(): "package-1.0.tar.gz"}
+
+    def test_cache(self):
+        sha256 = hashlib.sha256(b"package").hexdigest()
+        expected = [{sha256: "package-1.0.tar.gz"}]
+        with tempfile.TemporaryDirectory() as cache_dir:
+            assert self.get_simple_indexes(["package"], {sha256}, cache_dir=Path(cache_dir)) == expected
+            assert self.statuses == [200]
+
+            # All required files are cached
+            assert self.get_simple_indexes(["package"], {sha256}, cache_dir=Path(cache_dir)) == expected
+            assert self.statuses == [200]
+
+            # Missing files are revalidated
+            assert self.get_simple_indexes(["package"], {sha256, "0" * 64}, cache_dir=Path(cache_dir)) == expected
+            assert self.statuses == [200, 304]
+
+            # Corrupt entries are fetched again and replaced
+            (entry,) = Path(cache_dir).glob("*/*")
+            entry.write_text(entry.read_text()[:-10])
+            assert self.get_simple_indexes(["package"], {sha256}, cache_dir=Path(cache_dir)) == expected
+            assert self.statuses == [200, 304, 200] and json.loads(entry.read_text())["urls"] == expected[0]
+
+    def test_coalescing(self):
+        sha256 = hashlib.sha256(b"package").hexdigest()
+        names = ["package", "other", "package", "package", "other"]
+        indexes = self.get_simple_indexes(names, max_in_flight=4)
+        assert indexes[0] == indexes[2] == indexes[3] == {sha256: "package-1.0.tar.gz"}
+        assert self.statuses == [200, 200]
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache_dir = Path(cache_dir)
+            self.get_simple_indexes(["package"], {sha256}, cache_dir=cache_dir)
+            self.statuses.clear()
+
+            async def _inner(client):
+                # The second lookup misses a file in the cached page and revalidates it once for both lookups
+                required = [{sha256}, {sha256, "0" * 64}, {sha256, "1" * 64}]
+                lookups = (parser.get_simple_index("package", self.index_url, client, r) for r in required)
+                return await asyncio.gather(*lookups)
+
+            with parser.IndexClient(cache_dir=cache_dir) as client:
+                assert asyncio.run(_inner(client)) == [{sha256: "package-1.0.tar.gz"}] * 3
+            assert self.statuses == [304]
+
+    def test_timeout(self):
+        with self.assertRaises(TimeoutError):
+            self.get_simple_indexes(["slow"], timeout=0.2)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -57,6 +57,10 @@ def derive_environment_markers(interpreter, interpreter_markers, host_tags):
     """
     python_version = _get_python_version(interpreter)
 
+    # Free-threaded interpreters are python3.13t binaries of toolchains with a freethreaded suffix
+    basename = paths.basename(interpreter).removesuffix(".exe")
+    abiflags = "t" if "freethreaded" in interpreter or (basename.startswith("python3.") and basename.endswith("t")) else ""
+
     # Platform keys are normalized with underscore separators
     interpreter_normalized = interpreter.replace("-", "_")
     for fr, to in interpreter_markers.items():
@@ -68,6 +72,7 @@ def derive_environment_markers(interpreter, interpreter_markers, host_tags):
                 "platform_tags": [],
                 "python_version": python_version,
                 "python_full_version": _MINOR_MAPPING.get(python_version, python_version),
+                "abiflags": abiflags,
                 "interpreter": interpreter,
             }
             tags.update(**json.decode(to))
@@ -75,27 +80,55 @@ def derive_environment_markers(interpreter, interpreter_markers, host_tags):
 
     return "host", json.decode(host_tags)
 
-def include_dep(dep, markers, environment):
+def include_dep(dep, markers, environment, resolved = {}):
     """Evaluate dependencies based on parsed markers and environment tags.
 
     Args:
         dep: dependency label
-        markers: parsed dependency markers
+        markers: decoded dependency markers
         environment: environment tags
+        resolved: marker values resolved at generation time for the environment platform
 
     Returns:
         evaluated dependency markers with the environment tags.
         True if dependency has to be included or false to skip the dependency.
     """
-    if not markers:
-        return True
-    markers = json.decode(markers)
     if dep.label.name not in markers:
         return True
 
+    # Marker values resolved by the lock parser per platform and Python version
+    value = resolved.get(dep.label.name)
+    if type(value) == "dict":
+        value = value.get(environment.get("python_version"))
+    if value != None:
+        return value
+
     marker = markers[dep.label.name]
     return evaluate(parse(marker, environment))
 
+def _get_cpu_level(cpu_level):
+    arch, _, level = (cpu_level or "").rpartition("_v")
+    return (arch, int(level)) if arch and level.isdigit() else (None, 0)
+
+def select_variant(package, variants, cpu_level):
+    """Select the wheel variant with the highest CPU level supported by the platform.
+
+    Args:
+        package: baseline package target
+        variants: mapping of variant targets to CPU levels like x86_64_v3
+        cpu_level: CPU level of the target platform or None
+
+    Returns:
+        the variant target with the highest supported CPU level or the baseline package target.
+    """
+    arch, level = _get_cpu_level(cpu_level)
+    selected, selected_level = package, 0
+    for variant, variant_cpu_level in variants.items():
+        variant_arch, variant_level = _get_cpu_level(variant_cpu_level)
+        if variant_arch == arch and selected_level < variant_level and variant_level <= level:
+            selected, selected_level = variant, variant_level
+    return selected
+
 def get_imports(target):
     return target[PyInfo].imports if PyInfo in target else depset()
 
@@ -153,10 +186,12 @@ def _package_impl(ctx):
     py_runtime_info = py_toolchain.py3_runtime
     runtime_tag, tags = derive_environment_markers(py_runtime_info.interpreter.path, ctx.attr.platforms, ctx.attr.system_platform)
     python_version = tags["python_version"]
+    python_abi = tags.get("abiflags", "")
     platform_tags = tags["platform_tags"]
 
-    # Get package files
-    package_files = ctx.attr.package.files.to_list() if ctx.attr.package else []
+    # Get package files of the wheel variant for the platform CPU level or of the baseline package
+    package = select_variant(ctx.attr.package, ctx.attr.variants, tags.get("cpu_level"))
+    package_files = package.files.to_list() if package else []
     package_directory, package_import, output_files = None, [], package_files
     runtime_transitive_deps = [py_runtime_info.files]
 
@@ -170,7 +205,7 @@ def _package_impl(ctx):
         package_directory = paths.dirname(package_root_file.path)
 
     # Call "pip install" for the sdist or local packages
-    if ctx.attr.package and ctx.attr.package.label.name in ["pkg", "sdist"]:
+    if package and package.label.name in ["pkg", "sdist"]:
         # Get Python tooling toolchain and runfiles dependencies
         package_deps = ctx.attr._package_deps
         package_deps_info = ctx.attr._package_deps[DefaultInfo]
@@ -181,11 +216,11 @@ def _package_impl(ctx):
         build_transitive_deps = [py_runtime_info.files, package_deps_info.files, package_deps_runtime_info.files]
 
         # Declare package output directory
-        output = ctx.actions.declare_directory("{}/{}/{}".format(python_version, runtime_tag, ctx.label.name))
+        output = ctx.actions.declare_directory("{}{}/{}/{}".format(python_version, python_abi, runtime_tag, ctx.label.name))
 
         # Package imports from full path or short path relative to runfiles directory
         package_import = [output.path, output.short_path.replace("../", "")]
-        entry_points = ctx.actions.declare_file("{}/{}/.dist-info/{}/entry_points.txt".format(python_version, runtime_tag, ctx.label.name))
+        entry_points = ctx.actions.declare_file("{}{}/{}/.dist-info/{}/entry_points.txt".format(python_version, python_abi, runtime_tag, ctx.label.name))
         output_files = [output, entry_points]
 
         # Collect installation tool arguments
@@ -201,6 +236,7 @@ def _package_impl(ctx):
             entry_points.path,
         ]
         arguments += ["--develop"] if ctx.attr.develop else []
+        arguments += ["--abi", "cp{}{}".format(python_version.replace(".", ""), python_abi)] if python_abi else []
 
         for platform in platform_tags:
             arguments += ["--platform", platform]
@@ -303,7 +339,9 @@ def _package_impl(ctx):
         )
 
     # Create output information providers CcInfo and PyInfo
-    deps = [dep for dep in ctx.attr.deps if include_dep(dep, ctx.attr.markers, tags)]
+    markers = json.decode(ctx.attr.markers) if ctx.attr.markers else {}
+    resolved = json.decode(ctx.attr.resolved_markers or "{}").get(runtime_tag, {}) if markers else {}
+    deps = [dep for dep in ctx.attr.deps if include_dep(dep, markers, tags, resolved)]
 
     # PyInfo
     transitive_imports = [get_imports(dep) for dep in deps]
@@ -336,6 +374,10 @@ package_attrs = {
     "develop": attr.bool(),
     "enable_rust": attr.bool(default = True),
     "markers": attr.string(doc = "The JSON string with a dictionary of dependency markers accordingly to PEP 508"),
+    "resolved_markers": attr.string(
+        doc = "The JSON string with dependency marker values per platform name resolved by the lock parser, " +
+              "values of markers with Python version variables are mappings of Python versions to booleans",
+    ),
     "platforms": attr.string_dict(
         default = DEFAULT_PLATFORMS,
         doc = "The mapping of an interpter substring mapping to environment markers and platform tags as a JSON string. " +
@@ -343,6 +385,10 @@ package_attrs = {
               "https://github.com/bazelbuild/rules_python/blob/23cf6b66/python/versions.bzl#L231-L277",
     ),
     "system_platform": attr.string(doc = "The system platform environment markers as a JSON string"),
+    "variants": attr.label_keyed_string_dict(
+        doc = "The mapping of wheel variant targets to x86-64 micro-architecture levels like x86_64_v3, " +
+              "a variant with the highest level not above cpu_level of the platform replaces the package target",
+    ),
     "_libpython": attr.label_list(default = [
         "@rules_python//python/cc:current_py_cc_headers",
         "@rules_python//python/cc:current_py_cc_libs",
@@ -35,6 +35,9 @@ def get_platform_args(args):
     if args.python_version and args.python_version != "3":
         platform_args.append(f"--python-version={args.python_version}")
 
+    if args.abi:
+        platform_args.append(f"--abi={args.abi}")
+
     return platform_args
 
 
@@ -253,6 +256,7 @@ if __name__ == "__main__":
     parser_install.add_argument("output", type=Path, default=Path(), help="package output directory")
     parser_install.add_argument("--python_version", type=str, default=None, help="python version")
     parser_install.add_argument("--platform", type=str, nargs="*", action="extend", help="platform tag")
+    parser_install.add_argument("--abi", type=str, default=None, help="ABI tag like cp313t of the target interpreter")
     parser_install.add_argument("--source", type=str, help="source JSON ")
     parser_install.add_argument("--develop", action="store_true", help="Install develop package")
     parser_install.add_argument("--cc_toolchain", type=str, help="CC toolchain")
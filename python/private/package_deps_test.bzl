@@ -2,7 +2,7 @@
 
 load("@bazel_skylib//lib:partial.bzl", "partial")
 load("@bazel_skylib//lib:unittest.bzl", "asserts", "unittest")
-load("//python/private:package_deps.bzl", "DEFAULT_PLATFORMS", "derive_environment_markers")
+load("//python/private:package_deps.bzl", "DEFAULT_PLATFORMS", "derive_environment_markers", "include_dep", "select_variant")
 
 def _derive_environment_markers_test_impl(ctx):
     env = unittest.begin(ctx)
@@ -16,6 +16,13 @@ def _derive_environment_markers_test_impl(ctx):
     asserts.true(env, "python_full_version" in tags)
     asserts.true(env, tags["python_version"] == "3.11")
     asserts.true(env, tags["python_full_version"][:5] == "3.11.")
+    asserts.true(env, tags["abiflags"] == "")
+
+    interpreter_path = "rules_python~~python~python_3_13_x86_64-unknown-linux-gnu-freethreaded/bin/python3.13t"
+    runtime, tags = derive_environment_markers(interpreter_path, DEFAULT_PLATFORMS, "{}")
+    asserts.true(env, runtime == "x86_64-unknown-linux-gnu")
+    asserts.true(env, tags["python_version"] == "3.13")
+    asserts.true(env, tags["abiflags"] == "t")
 
     interpreter_path = "some/python/interpreter"
     runtime, tags = derive_environment_markers(interpreter_path, DEFAULT_PLATFORMS, "{}")
@@ -42,12 +49,49 @@ def _derive_environment_markers_host_test_impl(ctx):
 
     return unittest.end(env)
 
+def _include_dep_test_impl(ctx):
+    env = unittest.begin(ctx)
+
+    markers = {"colorama": 'sys_platform == "win32"', "tomli": 'python_version < "3.11"'}
+    environment = {"python_version": "3.10", "sys_platform": "win32"}
+    colorama, tomli, six = [struct(label = struct(name = name)) for name in ["colorama", "tomli", "six"]]
+
+    # Markers are evaluated without resolved values
+    asserts.true(env, include_dep(colorama, markers, environment))
+    asserts.true(env, include_dep(tomli, markers, environment))
+    asserts.true(env, include_dep(six, markers, environment))
+
+    # Resolved values take precedence and missing Python versions are evaluated
+    resolved = {"colorama": False, "tomli": {"3.11": False}}
+    asserts.false(env, include_dep(colorama, markers, environment, resolved))
+    asserts.true(env, include_dep(tomli, markers, environment, resolved))
+    asserts.false(env, include_dep(tomli, markers, environment | {"python_version": "3.11"}, resolved))
+
+    return unittest.end(env)
+
+def _select_variant_test_impl(ctx):
+    env = unittest.begin(ctx)
+
+    variants = {"v2": "x86_64_v2", "v3": "x86_64_v3", "v4": "x86_64_v4"}
+    asserts.equals(env, "whl", select_variant("whl", variants, None))
+    asserts.equals(env, "whl", select_variant("whl", variants, "x86_64_v1"))
+    asserts.equals(env, "v3", select_variant("whl", variants, "x86_64_v3"))
+    asserts.equals(env, "v4", select_variant("whl", variants, "x86_64_v4"))
+    asserts.equals(env, "whl", select_variant("whl", variants, "aarch64_v3"))
+    asserts.equals(env, "whl", select_variant("whl", {}, "x86_64_v4"))
+
+    return unittest.end(env)
+
 derive_environment_markers_test = unittest.make(_derive_environment_markers_test_impl)
 derive_environment_markers_host_test = unittest.make(_derive_environment_markers_host_test_impl)
+include_dep_test = unittest.make(_include_dep_test_impl)
+select_variant_test = unittest.make(_select_variant_test_impl)
 
 def package_deps_test_suite():
     unittest.suite(
         "package_deps_bzl_test",
         partial.make(derive_environment_markers_test),
         partial.make(derive_environment_markers_host_test),
+        partial.make(include_dep_test),
+        partial.make(select_variant_test),
     )
@@ -21,6 +21,7 @@ class InstallArgs:
     output = None
     platform = None
     python_version = get_python_version()
+    abi = None
     develop = False
     cc_toolchain = None
     rust_toolchain = None
@@ -63,6 +64,19 @@ class TestInstallSubcommand(unittest.TestCase):
         ):
             main.install(args)
 
+    def test_platform_args(self):
+        args = InstallArgs()
+        args.platform = ["manylinux_2_17_x86_64"]
+        args.python_version = "3.13"
+        self.assertEqual(main.get_platform_args(args), ["--platform=manylinux_2_17_x86_64", "--python-version=3.13"])
+
+        # Free-threaded runtimes select wheels with the free-threaded ABI tag
+        args.abi = "cp313t"
+        self.assertEqual(
+            main.get_platform_args(args),
+            ["--platform=manylinux_2_17_x86_64", "--python-version=3.13", "--abi=cp313t"],
+        )
+
     def test_no_download_with_source_url(self):
         args = InstallArgs()
         args.input = "/x"